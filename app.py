@@ -1,6 +1,13 @@
 import os
-from flask import Flask, flash, render_template, request, redirect, url_for, session
+import json
+import shutil
+import tempfile
+import time
+from flask import Flask, flash, render_template, request, redirect, url_for, session, jsonify, Response
 from database import *
+from enrollment_import import import_people, report_summary
+from recognition_jobs import job_manager, UPLOAD_EXTENSIONS, FINISHED_STATES
+import metrics
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
@@ -10,13 +17,15 @@ ADMIN_USERNAME = "admin"
 ADMIN_PASSWORD = "admin"
 ADMIN_ASSIGNED_USERNAME = "admin"
 
+# Rows per page of the teacher's attendance table
+ATTENDANCE_PAGE_SIZE = 50
+MAX_ATTENDANCE_PAGE_SIZE = 500
 
-# Initialize databases
-init_teachers_db()
-init_students_db()
-init_subjects_db()
-init_teacher_passwords_db()
-init_student_passwords_db()
+
+# Initialize the database and reuse pooled connections across each request
+init_db()
+init_app(app)
+metrics.init_app(app)
 
 
 @app.route('/')
@@ -81,6 +90,11 @@ def assign_teacher():
             delete_teacher_by_id(teacher_id_to_delete)
             flash('Teacher deleted successfully', 'success')
 
+        # Check if the form is submitted for deleting the selected teachers
+        elif request.form.getlist('delete_teacher_ids'):
+            deleted = delete_teachers_by_ids(request.form.getlist('delete_teacher_ids', type=int))
+            flash('{} teachers deleted successfully'.format(deleted), 'success')
+
     # Get all teachers for displaying in the form
     teachers = get_all_teachers()
     return render_template('assign_teacher.html', teachers=teachers)
@@ -112,11 +126,51 @@ def assign_student():
             delete_student_by_id(student_id_to_delete)
             flash('Student deleted successfully', 'success')
 
+        # Check if the form is submitted for deleting the selected students
+        elif request.form.getlist('delete_student_ids'):
+            deleted = delete_students_by_ids(request.form.getlist('delete_student_ids', type=int))
+            flash('{} students deleted successfully'.format(deleted), 'success')
+
     # Get all students for displaying in the form
     students = get_all_students()
     return render_template('assign_student.html', students=students)
 
 
+@app.route('/admin/import', methods=['GET', 'POST'])
+def admin_import():
+    if 'username' not in session:
+        return redirect(url_for('index'))
+
+    if request.method == 'GET':
+        return render_template('admin_import.html')
+
+    if 'csv' not in request.files or not request.files['csv'].filename:
+        return jsonify({"error": "No CSV file uploaded"}), 400
+    kind = request.form.get('kind', 'student')
+    if kind not in ('student', 'teacher'):
+        return jsonify({"error": "Unknown kind of person"}), 400
+
+    # The uploads are saved first, since the import keeps reading them after the view returns
+    upload_dir = tempfile.mkdtemp(prefix="import_")
+    csv_path = os.path.join(upload_dir, "people.csv")
+    request.files['csv'].save(csv_path)
+    photos_path = None
+    if request.files.get('photos') and request.files['photos'].filename:
+        photos_path = os.path.join(upload_dir, "photos.zip")
+        request.files['photos'].save(photos_path)
+
+    # Stream one JSON line per imported chunk, so the page can show progress
+    def generate():
+        try:
+            with open(csv_path, newline='', encoding='utf-8-sig') as csv_file:
+                for report in import_people(csv_file, kind, photos_path):
+                    yield json.dumps(report_summary(report)) + "\n"
+        finally:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
 @app.route('/assign_subject', methods=['GET', 'POST'])
 def assign_subject():
     if 'username' not in session:
@@ -160,6 +214,25 @@ def teacher_login():
     return render_template('teacher_login.html')
 
 
+# Function to read the attendance table filters, sort order and page from the query string
+def attendance_page_args(args):
+    try:
+        below = float(args['below']) if args.get('below') else None
+    except ValueError:
+        below = None
+    page = max(1, args.get('page', 1, type=int))
+    per_page = min(max(1, args.get('per_page', ATTENDANCE_PAGE_SIZE, type=int)), MAX_ATTENDANCE_PAGE_SIZE)
+    return {
+        "department": args.get('department') or None,
+        "semester": args.get('semester') or None,
+        "below": below,
+        "sort": args.get('sort', 'student_id'),
+        "descending": args.get('order') == 'desc',
+        "limit": per_page,
+        "offset": (page - 1) * per_page,
+    }
+
+
 @app.route('/teacher/dashboard', methods=['GET', 'POST'])
 def teacher_dashboard():
     if 'username' in session:
@@ -169,34 +242,230 @@ def teacher_dashboard():
 
         teacher_data = teacher_subject_map.get(teacher_username)
         if teacher_data:
-            subject = teacher_data["subject"]
-            database_path = teacher_data["database"]
-
-            # Get the total classes taken by the teacher
-            total_classes_taken = get_total_classes_taken(database_path, teacher_username)
-
-            # Assuming you have a function to fetch attendance data from the database
-            attendance_data = fetch_attendance_data(database_path, teacher_username)
+            # Teachers with several subjects pick one; the primary subject is shown by default
+            subject = request.args.get('subject') or teacher_data["subject"]
+            if subject not in teacher_data["subjects"]:
+                return f"You do not teach {subject}.", 403
 
             # Handle POST request for updating classes present
             if request.method == 'POST':
                 student_id = request.form.get('student_id')
                 classes_present = int(request.form.get('classes_present'))
 
-                # Update the classes present in the corresponding subject's database
-                update_classes_present_in_database(database_path, student_id, classes_present)
+                # Update the classes present for the teacher's subject
+                update_classes_present_in_database(subject, student_id, classes_present)
 
-                # Redirect to avoid form resubmission
-                return redirect('/teacher/dashboard')
+                # Redirect to avoid form resubmission, keeping the filters
+                return redirect(url_for('teacher_dashboard', **request.args))
+
+            # Get the total classes taken by the teacher
+            total_classes_taken = get_total_classes_taken(subject, teacher_username)
+
+            # Only the first page is rendered; the rest is loaded from /teacher/attendance.json
+            page_args = attendance_page_args(request.args)
+            attendance_data, total_students = fetch_attendance_page(subject, **page_args)
+            departments, semesters = get_student_filters()
 
             return render_template('teacher_dashboard.html', teacher_username=teacher_username, subject=subject,
-                                   total_classes_taken=total_classes_taken, attendance_data=attendance_data)
+                                   subjects=teacher_data["subjects"], total_classes_taken=total_classes_taken, attendance_data=attendance_data,
+                                   total_students=total_students, per_page=page_args["limit"],
+                                   departments=departments, semesters=semesters, filters=request.args)
         else:
             return "Subject not found for this teacher."
     else:
         return redirect(url_for('teacher_login'))
 
 
+@app.route('/teacher/attendance.json')
+def teacher_attendance_json():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    teacher_data = get_teacher_subject_map().get(session['username'])
+    if not teacher_data:
+        return jsonify({"error": "Subject not found for this teacher."}), 404
+
+    subject = request.args.get('subject') or teacher_data["subject"]
+    if subject not in teacher_data["subjects"]:
+        return jsonify({"error": f"You do not teach {subject}."}), 403
+
+    page_args = attendance_page_args(request.args)
+    rows, total = fetch_attendance_page(subject, **page_args)
+    return jsonify({
+        "subject": subject,
+        "total": total,
+        "page": page_args["offset"] // page_args["limit"] + 1,
+        "per_page": page_args["limit"],
+        "rows": [{"student_id": student_id, "name": name, "department": department, "semester": semester,
+                  "classes_present": classes_present, "attendance_percentage": attendance_percentage}
+                 for student_id, name, department, semester, classes_present, attendance_percentage in rows],
+    })
+
+
+# Function to work out which of the logged-in teacher's subjects and which period a recognition job is for.
+# Returns (subject, period, None) or (None, None, error response).
+def recognition_job_args(form):
+    teacher_data = get_teacher_subject_map().get(session['username'])
+    if not teacher_data:
+        return None, None, (jsonify({"error": "Subject not found for this teacher."}), 404)
+    subject = form.get('subject') or teacher_data["subject"]
+    if subject not in teacher_data["subjects"]:
+        return None, None, (jsonify({"error": f"You do not teach {subject}."}), 403)
+
+    period = form.get('period', type=int) or job_manager.current_period()
+    if period is None:
+        return None, None, (jsonify({"error": "No period is scheduled now."}), 409)
+    return subject, period, None
+
+
+# Function to describe a job in a response, with where to follow it
+def recognition_job_response(job, status=202):
+    return jsonify(dict(job.snapshot(), status_url=url_for('recognition_job_status', job_id=job.id),
+                        events_url=url_for('recognition_job_events', job_id=job.id))), status
+
+
+# Function to find one of the logged-in teacher's jobs, or None
+def teacher_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None or job.teacher_username != session.get('username'):
+        return None
+    return job
+
+
+# Recognition runs in the background: these return a job id at once, and its progress is
+# followed at /teacher/recognition/<job_id> or streamed from /teacher/recognition/<job_id>/events
+@app.route('/teacher/recognition', methods=['GET'])
+def recognition_jobs():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    return jsonify([job.snapshot() for job in job_manager.jobs_for(session['username'])])
+
+
+@app.route('/teacher/recognition/start', methods=['POST'])
+def recognition_start():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    subject, period, error = recognition_job_args(request.form)
+    if error:
+        return error
+    try:
+        job = job_manager.start_session(session['username'], subject, period)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    return recognition_job_response(job)
+
+
+@app.route('/teacher/recognition/upload', methods=['POST'])
+def recognition_upload():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    media = request.files.get('media')
+    extension = os.path.splitext(media.filename)[1].lower() if media and media.filename else ''
+    if extension not in UPLOAD_EXTENSIONS:
+        return jsonify({"error": "Upload a photo or a short clip of the class."}), 400
+    subject, period, error = recognition_job_args(request.form)
+    if error:
+        return error
+
+    # The job deletes the file once it has been read
+    fd, path = tempfile.mkstemp(prefix="recognition_", suffix=extension)
+    os.close(fd)
+    media.save(path)
+    job = job_manager.start_upload(session['username'], subject, period, path)
+    return recognition_job_response(job)
+
+
+@app.route('/teacher/recognition/<job_id>/stop', methods=['POST'])
+def recognition_stop(job_id):
+    job = teacher_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    job_manager.stop(job)
+    return recognition_job_response(job, 200)
+
+
+@app.route('/teacher/recognition/<job_id>')
+def recognition_job_status(job_id):
+    job = teacher_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.snapshot())
+
+
+# Server-sent events with a snapshot of the job each time it changes, until it is over
+@app.route('/teacher/recognition/<job_id>/events')
+def recognition_job_events(job_id):
+    job = teacher_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def stream():
+        version = None
+        while True:
+            snapshot = job.wait(version, timeout=15)
+            if snapshot["version"] == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = snapshot["version"]
+            yield f"id: {version}\ndata: {json.dumps(snapshot)}\n\n"
+            if snapshot["state"] in FINISHED_STATES:
+                return
+
+    return Response(stream(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+
+# Attendance written for one of the teacher's subjects (?subject=, by default their first), pushed
+# to the dashboard as server-sent events. Each event is one student marked present; a student's
+# newest event carries their current totals, older ones null. A client only receives what was
+# written after the last event it saw (Last-Event-ID), so the attendance table is never re-read.
+# Writes from this process wake the stream at once; others are found by polling every interval.
+ATTENDANCE_POLL_INTERVAL = 2.0
+ATTENDANCE_KEEP_ALIVE = 15.0
+ATTENDANCE_BATCH_SIZE = 500
+
+
+@app.route('/teacher/attendance/stream')
+def teacher_attendance_stream():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    teacher_data = get_teacher_subject_map().get(session['username'])
+    if not teacher_data:
+        return jsonify({"error": "Subject not found for this teacher."}), 404
+    subject = request.args.get('subject') or teacher_data["subject"]
+    if subject not in teacher_data["subjects"]:
+        return jsonify({"error": f"You do not teach {subject}."}), 403
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        last_event_id = int(last_event_id)
+    except (TypeError, ValueError):
+        last_event_id = get_last_attendance_event_id()
+
+    def stream():
+        event_id = last_event_id
+        generation = None
+        idle = 0.0
+        yield f"retry: {int(ATTENDANCE_POLL_INTERVAL * 1000)}\n\n"
+        while True:
+            events = get_attendance_events_since(subject, event_id, ATTENDANCE_BATCH_SIZE)
+            for event_id, student_id, date, period, recorded_at, classes_present, attendance_percentage in events:
+                yield f"id: {event_id}\ndata: " + json.dumps({
+                    "student_id": student_id, "date": date, "period": period, "recorded_at": recorded_at,
+                    "classes_present": classes_present, "attendance_percentage": attendance_percentage}) + "\n\n"
+            if len(events) == ATTENDANCE_BATCH_SIZE:
+                continue
+            if events:
+                idle = 0.0
+            elif idle >= ATTENDANCE_KEEP_ALIVE:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            started = time.monotonic()
+            generation = wait_for_attendance(generation, ATTENDANCE_POLL_INTERVAL)
+            idle += time.monotonic() - started
+
+    return Response(stream(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+
 @app.route('/teacher/set_password', methods=['GET', 'POST'])
 def teacher_set_password():
     if request.method == 'POST':
@@ -252,14 +521,14 @@ def student_dashboard():
     if not student_username:
         return redirect(url_for('student_login'))
 
-    # Get the attendance data for each subject
+    # Get the attendance data for each subject in one query
     teacher_subject_map = get_teacher_subject_map()
+    attendance_summary = get_student_attendance_summary(student_username)
     attendance_data = {}
 
     for teacher, subject_info in teacher_subject_map.items():
-        database_path = subject_info['database']
-        attendance_percentage = get_student_attendance(database_path, student_username)
-        attendance_data[subject_info['subject']] = attendance_percentage
+        for subject in subject_info['subjects']:
+            attendance_data[subject] = attendance_summary.get(subject)
 
     return render_template('student_dashboard.html', student_username=student_username, attendance_data=attendance_data)
 
@@ -281,6 +550,30 @@ def student_set_password():
     return render_template('student_set_password.html')
 
 
+# Function to tell whether a request may read the metrics: the admin, or a scraper with the metrics token
+def metrics_allowed():
+    return session.get('username') == ADMIN_USERNAME or metrics.token_matches(request.headers.get('Authorization'))
+
+
+# Request, query and attendance metrics in the Prometheus text format
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics_allowed():
+        return jsonify({"error": "Not allowed"}), 403
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+
+# Stacks the app spent most time in over the next few seconds, for the admin to find hot paths
+@app.route('/metrics/profile')
+def metrics_profile():
+    if not metrics_allowed():
+        return jsonify({"error": "Not allowed"}), 403
+    seconds = metrics.profile_seconds(request.args.get('seconds'))
+    if seconds is None:
+        return jsonify({"error": "seconds must be a positive number"}), 400
+    return Response(metrics.profile(seconds), mimetype=metrics.CONTENT_TYPE)
+
+
 @app.route('/logout')
 def logout():
     session.pop('username', None)
@@ -0,0 +1,92 @@
+import os
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import database
+from passwords import hash_password
+
+
+# Function to fill the database with teachers and students who all have passwords and attendance
+def seed(teachers, students):
+    database.init_db()
+    db = database.get_db()
+    with db:
+        db.executemany("INSERT INTO teachers (name, username) VALUES (?, ?)",
+                       [(f"Teacher {i}", f"teacher{i:02d}") for i in range(1, teachers + 1)])
+        db.executemany("INSERT INTO students (name, username, semester, department) VALUES (?, ?, ?, ?)",
+                       [(f"Student {i}", f"student{i}", str(i % 8 + 1), "CS") for i in range(students)])
+        # One hash shared by everyone keeps seeding fast, and since verified passwords are cached by
+        # hash, logins after the first skip the key derivation, so the database path is what is measured
+        password_hash = hash_password("password")
+        db.executemany("INSERT INTO teacher_passwords (username, password_hash) VALUES (?, ?)",
+                       [(f"teacher{i:02d}", password_hash) for i in range(1, teachers + 1)])
+        db.executemany("INSERT INTO student_passwords (username, password_hash) VALUES (?, ?)",
+                       [(f"student{i}", password_hash) for i in range(students)])
+        db.executemany("INSERT INTO attendance (subject, student_id, classes_present, attendance_percentage) "
+                       "VALUES (?, ?, 3, 75)", [(subject, f"student{i}") for i in range(students)
+                                                 for subject in ("DCC", "IEFT", "CD", "AAD", "CGIP")])
+    database.close_db(db)
+
+
+# Function to log in as one user and open their dashboard, returning the latency of each request in ms
+def login_burst_user(app, user):
+    client = app.test_client()
+    kind, username = user
+    latencies = []
+    for method, path, data in [("post", f"/{kind}/login", {"username": username, "password": "password"}),
+                               ("get", f"/{kind}/dashboard", None)]:
+        start = time.perf_counter()
+        response = getattr(client, method)(path, data=data)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code in (200, 302), response.status_code
+    return latencies
+
+
+# Function to run a login burst with the given number of concurrent users
+def run_burst(app, users, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = [ms for user_latencies in executor.map(lambda user: login_burst_user(app, user), users)
+                     for ms in user_latencies]
+    return np.array(latencies), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure request latency with and without pooled database connections")
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--logins", type=int, default=2000, help="users logging in during the burst")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Work on a throwaway database so the real one is never touched
+    workdir = tempfile.mkdtemp(prefix="bench_db_")
+    os.chdir(workdir)
+    database.DATABASE = os.path.join(workdir, "bench.db")
+    seed(5, args.students)
+
+    from app import app
+    app.config["TESTING"] = True
+    users = [("student", f"student{i % args.students}") for i in range(args.logins)]
+    users[::10] = [("teacher", f"teacher{i % 5 + 1:02d}") for i in range(len(users[::10]))]
+
+    print(f"{args.logins} logins, {args.concurrency} concurrent, each a login POST and a dashboard GET")
+    print(f"{'connections':<14}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'requests/s':>12}")
+    for pooled in (False, True):
+        database.POOL_CONNECTIONS = pooled
+        database.close_pools()
+        best = None
+        for _ in range(args.repeat):
+            latencies, elapsed = run_burst(app, users, args.concurrency)
+            if best is None or elapsed < best[1]:
+                best = latencies, elapsed
+        latencies, elapsed = best
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        print(f"{'pooled' if pooled else 'per call':<14}{p50:>10.2f}{p90:>10.2f}{p99:>10.2f}"
+              f"{len(latencies) / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
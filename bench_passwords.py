@@ -0,0 +1,57 @@
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import passwords
+
+
+# Cost settings compared by default: (scheme, setting name, value)
+SETTINGS = [
+    ("scrypt", "SCRYPT_N", 2 ** 12),
+    ("scrypt", "SCRYPT_N", 2 ** 14),
+    ("scrypt", "SCRYPT_N", 2 ** 15),
+    ("pbkdf2_sha256", "PBKDF2_ITERATIONS", 100000),
+    ("pbkdf2_sha256", "PBKDF2_ITERATIONS", 600000),
+]
+
+
+# Function to verify every user's password from a number of concurrent request threads,
+# returning logins per second
+def run_logins(users, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda user: passwords.verify_password(*user), users))
+    elapsed = time.perf_counter() - start
+    assert all(results)
+    return len(users) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure password logins/sec at several key derivation costs")
+    parser.add_argument("--users", type=int, default=64, help="distinct users logging in")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent login requests")
+    args = parser.parse_args()
+
+    print(f"{args.users} users, {args.concurrency} concurrent requests, {passwords.VERIFY_WORKERS} verify workers")
+    print(f"{'setting':<40}{'hash ms':>10}{'logins/s':>12}{'cached logins/s':>18}")
+    for scheme, setting, value in SETTINGS:
+        passwords.PASSWORD_SCHEME = scheme
+        setattr(passwords, setting, value)
+        passwords.credential_cache.clear()
+
+        start = time.perf_counter()
+        users = [(f"password{i}", passwords.hash_password(f"password{i}")) for i in range(args.users)]
+        hash_ms = (time.perf_counter() - start) * 1000 / args.users
+
+        # First logins run the key derivation; repeated logins within the TTL hit the cache
+        cold = run_logins(users, args.concurrency)
+        cached = run_logins(users, args.concurrency)
+        print(f"{scheme + ' ' + setting + '=' + str(value):<40}{hash_ms:>10.1f}{cold:>12.0f}{cached:>18.0f}")
+
+    passwords.credential_cache.clear()
+    legacy = [(f"password{i}", hashlib.sha256(f"password{i}".encode()).hexdigest()) for i in range(args.users)]
+    print(f"{'legacy sha256':<40}{'':>10}{run_logins(legacy, args.concurrency):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,147 +1,384 @@
 import sqlite3
-import hashlib
-
-TEACHERS_DATABASE = 'teachers.db'
-STUDENTS_DATABASE = 'students.db'
-SUBJECTS_DATABASE = 'subjects.db'
-TEACHER_PASSWORDS_DATABASE = 'teacher_passwords.db'
-STUDENT_PASSWORD_DATABASE = 'student_passwords.db'
-
-def get_teachers_db():
-    db = sqlite3.connect(TEACHERS_DATABASE)
-    return db
-
-def get_students_db():
-    db = sqlite3.connect(STUDENTS_DATABASE)
+import threading
+from collections import OrderedDict
+from passwords import hash_password, verify_password, needs_rehash, rehash_password
+from metrics import timer
+
+# Teachers, students, subjects, passwords and attendance for every subject live in one database
+DATABASE = 'attendance_system.db'
+
+# The attendance event log. id only grows (AUTOINCREMENT), so readers can follow the log by the last id they saw.
+ATTENDANCE_EVENTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS attendance_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    student_id TEXT NOT NULL REFERENCES students (username) ON UPDATE CASCADE ON DELETE CASCADE,
+    subject TEXT NOT NULL,
+    date TEXT NOT NULL,
+    period INTEGER NOT NULL,
+    recorded_at TEXT NOT NULL,
+    UNIQUE (student_id, subject, date, period)
+);
+'''
+ATTENDANCE_EVENTS_INDEX = "CREATE INDEX IF NOT EXISTS idx_attendance_events_session ON attendance_events (subject, date, period)"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS teachers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    username TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS students (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    username TEXT NOT NULL UNIQUE,
+    semester TEXT NOT NULL,
+    department TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_students_department_semester ON students (department, semester);
+CREATE INDEX IF NOT EXISTS idx_students_semester ON students (semester);
+
+CREATE TABLE IF NOT EXISTS subjects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    teacher_username TEXT REFERENCES teachers (username) ON UPDATE CASCADE ON DELETE SET NULL
+);
+CREATE INDEX IF NOT EXISTS idx_subjects_teacher_username ON subjects (teacher_username);
+CREATE INDEX IF NOT EXISTS idx_subjects_name ON subjects (name);
+
+-- Bumped whenever a cached table changes, from any process; see get_teacher_subject_map
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TRIGGER IF NOT EXISTS subjects_version_insert AFTER INSERT ON subjects BEGIN
+    INSERT INTO cache_versions (name, version) VALUES ('subjects', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS subjects_version_update AFTER UPDATE ON subjects BEGIN
+    INSERT INTO cache_versions (name, version) VALUES ('subjects', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS subjects_version_delete AFTER DELETE ON subjects BEGIN
+    INSERT INTO cache_versions (name, version) VALUES ('subjects', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+END;
+
+-- Weekly timetable: which subject is taught in which room, weekday (Monday = 0) and period.
+-- Times are "HH:MM" and both ends are inclusive, like the old period schedule.
+CREATE TABLE IF NOT EXISTS timetable (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room TEXT NOT NULL,
+    weekday INTEGER NOT NULL CHECK (weekday BETWEEN 0 AND 6),
+    period INTEGER NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    subject TEXT,
+    teacher_username TEXT REFERENCES teachers (username) ON UPDATE CASCADE ON DELETE SET NULL,
+    UNIQUE (room, weekday, period)
+);
+
+-- Days without classes, as "YYYY-MM-DD"
+CREATE TABLE IF NOT EXISTS holidays (
+    date TEXT PRIMARY KEY,
+    name TEXT
+);
+
+CREATE TRIGGER IF NOT EXISTS timetable_version_insert AFTER INSERT ON timetable BEGIN
+    INSERT INTO cache_versions (name, version) VALUES ('timetable', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS timetable_version_update AFTER UPDATE ON timetable BEGIN
+    INSERT INTO cache_versions (name, version) VALUES ('timetable', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS timetable_version_delete AFTER DELETE ON timetable BEGIN
+    INSERT INTO cache_versions (name, version) VALUES ('timetable', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS holidays_version_insert AFTER INSERT ON holidays BEGIN
+    INSERT INTO cache_versions (name, version) VALUES ('timetable', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS holidays_version_update AFTER UPDATE ON holidays BEGIN
+    INSERT INTO cache_versions (name, version) VALUES ('timetable', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS holidays_version_delete AFTER DELETE ON holidays BEGIN
+    INSERT INTO cache_versions (name, version) VALUES ('timetable', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TABLE IF NOT EXISTS teacher_passwords (
+    username TEXT PRIMARY KEY REFERENCES teachers (username) ON UPDATE CASCADE ON DELETE CASCADE,
+    password_hash TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS student_passwords (
+    username TEXT PRIMARY KEY REFERENCES students (username) ON UPDATE CASCADE ON DELETE CASCADE,
+    password_hash TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS classes_taken (
+    subject TEXT NOT NULL,
+    teacher_username TEXT NOT NULL,
+    classes_taken REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (subject, teacher_username)
+);
+
+-- One row per class held. Starting a class again in the same period (another upload, a restarted
+-- session or recognizer) is ignored by the key, and each new row counts one class in classes_taken.
+CREATE TABLE IF NOT EXISTS classes_held (
+    subject TEXT NOT NULL,
+    teacher_username TEXT NOT NULL,
+    date TEXT NOT NULL,
+    period INTEGER NOT NULL,
+    PRIMARY KEY (subject, teacher_username, date, period)
+);
+CREATE TRIGGER IF NOT EXISTS classes_held_count AFTER INSERT ON classes_held BEGIN
+    INSERT INTO classes_taken (subject, teacher_username, classes_taken) VALUES (NEW.subject, NEW.teacher_username, 1)
+    ON CONFLICT (subject, teacher_username) DO UPDATE SET classes_taken = classes_taken + 1;
+END;
+
+CREATE TABLE IF NOT EXISTS attendance (
+    subject TEXT NOT NULL,
+    student_id TEXT NOT NULL REFERENCES students (username) ON UPDATE CASCADE ON DELETE CASCADE,
+    classes_present REAL NOT NULL DEFAULT 0,
+    attendance_percentage REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (subject, student_id)
+);
+CREATE INDEX IF NOT EXISTS idx_attendance_student_id ON attendance (student_id);
+
+-- Bumped by the triggers below whenever any of a student's attendance rows changes, from any
+-- process, so cached attendance summaries can be checked with one primary-key lookup
+CREATE TABLE IF NOT EXISTS attendance_versions (
+    student_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TRIGGER IF NOT EXISTS attendance_versions_insert AFTER INSERT ON attendance BEGIN
+    INSERT INTO attendance_versions (student_id, version) VALUES (NEW.student_id, 1)
+    ON CONFLICT (student_id) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS attendance_versions_update AFTER UPDATE ON attendance
+WHEN OLD.classes_present IS NOT NEW.classes_present
+  OR OLD.attendance_percentage IS NOT NEW.attendance_percentage
+  OR OLD.student_id IS NOT NEW.student_id
+  OR OLD.subject IS NOT NEW.subject BEGIN
+    INSERT INTO attendance_versions (student_id, version) VALUES (OLD.student_id, 1)
+    ON CONFLICT (student_id) DO UPDATE SET version = version + 1;
+    INSERT INTO attendance_versions (student_id, version) VALUES (NEW.student_id, 1)
+    ON CONFLICT (student_id) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS attendance_versions_delete AFTER DELETE ON attendance BEGIN
+    INSERT INTO attendance_versions (student_id, version) VALUES (OLD.student_id, 1)
+    ON CONFLICT (student_id) DO UPDATE SET version = version + 1;
+END;
+''' + ATTENDANCE_EVENTS_TABLE + '''
+''' + ATTENDANCE_EVENTS_INDEX + ''';
+'''
+
+# Reuse connections instead of opening one per query. Set to False to open and close a
+# connection for every helper call, as before.
+POOL_CONNECTIONS = True
+POOL_SIZE = 8
+
+# Statements cached per connection; a reused connection keeps its prepared statements
+CACHED_STATEMENTS = 256
+
+PRAGMAS = [
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA journal_mode = WAL",        # Readers do not block the attendance writer and vice versa
+    "PRAGMA synchronous = NORMAL",      # Safe with WAL, and avoids an fsync on every commit
+    "PRAGMA cache_size = -8000",        # 8 MB page cache per connection
+    "PRAGMA mmap_size = 67108864",      # Read pages through a 64 MB memory map
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+]
+
+# Decorator timing each query helper below, reported as db_query_seconds{query="<function>"}
+timed_query = timer("db_query_seconds", "Time spent in a database.py query helper", "query")
+
+
+# Function to open a new connection with the pragmas applied.
+# Connections may be handed between threads by the pool, but only one thread uses one at a time.
+def connect_db():
+    db = sqlite3.connect(DATABASE, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    for pragma in PRAGMAS:
+        db.execute(pragma)
     return db
 
-def get_subjects_db():
-    db = sqlite3.connect(SUBJECTS_DATABASE)
-    return db
-
-def get_teacher_passwords_db():
-    db = sqlite3.connect(TEACHER_PASSWORDS_DATABASE)
-    return db
 
-def get_student_passwords_db():
-    db = sqlite3.connect(STUDENT_PASSWORD_DATABASE)
+# Idle connections to one database file, shared by all threads
+class ConnectionPool:
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return connect_db()
+
+    def release(self, db):
+        # Never hand on a connection in the middle of a transaction
+        if db.in_transaction:
+            db.rollback()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(db)
+                return
+        db.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for db in idle:
+            db.close()
+
+
+_pools = {}  # database path -> ConnectionPool
+_pools_lock = threading.Lock()
+_local = threading.local()  # The connection a thread is using, and how many callers share it
+
+
+def _get_pool():
+    with _pools_lock:
+        pool = _pools.get(DATABASE)
+        if pool is None:
+            pool = _pools[DATABASE] = ConnectionPool()
+        return pool
+
+
+# Function to get a connection for the current thread.
+# Nested calls on one thread (several helpers in one request) share the same connection,
+# which goes back to the pool when the outermost caller closes it.
+def get_db():
+    if not POOL_CONNECTIONS:
+        return connect_db()
+
+    if getattr(_local, "db", None) is not None and _local.database == DATABASE:
+        _local.depth += 1
+        return _local.db
+
+    pool = _get_pool()
+    db = pool.acquire()
+    _local.db, _local.database, _local.depth, _local.pool = db, DATABASE, 1, pool
     return db
 
 def close_db(db):
-    db.close()
-
-def init_teachers_db():
-    db = get_teachers_db()
-    cursor = db.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS teachers (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        username TEXT NOT NULL
-                     )''')
-    db.commit()
-    close_db(db)
-
-def init_students_db():
-    db = get_students_db()
-    cursor = db.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS students (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        username TEXT NOT NULL,
-                        semester TEXT NOT NULL,
-                        department TEXT NOT NULL
-                     )''')
-    db.commit()
-    close_db(db)
-
-def init_subjects_db():
-    db = get_subjects_db()
-    cursor = db.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS subjects (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        teacher_username TEXT,
-                        FOREIGN KEY (teacher_username) REFERENCES teachers(username)
-                     )''')
+    if getattr(_local, "db", None) is not db:
+        db.close()
+        return
+
+    _local.depth -= 1
+    if _local.depth == 0:
+        _local.pool.release(db)
+        _local.db = _local.pool = None
+
+# Function to close every idle pooled connection, e.g. before removing a database file
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+# Function to hold one pooled connection for the whole of each Flask request, so all the
+# helpers a view calls reuse it, and to return it to the pool when the request ends
+def init_app(app):
+    @app.before_request
+    def hold_db():
+        if POOL_CONNECTIONS:
+            _local.request_db = get_db()
+
+    @app.teardown_request
+    def release_db(exception=None):
+        db = getattr(_local, "request_db", None)
+        if db is not None:
+            _local.request_db = None
+            close_db(db)
+
+def init_db():
+    db = get_db()
+    db.executescript(SCHEMA)
+    _add_attendance_event_ids(db)
     db.commit()
     close_db(db)
-    
-    
-def init_teacher_passwords_db():
-    db = get_teacher_passwords_db()
-    cursor = db.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS teacher_passwords (
-                        username TEXT PRIMARY KEY,
-                        password_hash TEXT NOT NULL
-                     )''')
-    db.commit()
-    close_db(db)    
-    
-def init_student_passwords_db():
-    db = get_student_passwords_db()
-    cursor = db.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS student_passwords (
-                        username TEXT PRIMARY KEY,
-                        password_hash TEXT NOT NULL
-                     )''')
-    db.commit()
-    close_db(db) 
-    
 
+# Function to give an attendance event log created without an id column one, numbering the
+# events in the order they were logged
+def _add_attendance_event_ids(db):
+    columns = [row[1] for row in db.execute("PRAGMA table_info(attendance_events)")]
+    if "id" in columns:
+        return
+    with db:
+        db.execute("ALTER TABLE attendance_events RENAME TO attendance_events_old")
+        db.execute(ATTENDANCE_EVENTS_TABLE)
+        db.execute('''INSERT INTO attendance_events (student_id, subject, date, period, recorded_at)
+                      SELECT student_id, subject, date, period, recorded_at FROM attendance_events_old
+                      ORDER BY rowid''')
+        db.execute("DROP TABLE attendance_events_old")
+        db.execute(ATTENDANCE_EVENTS_INDEX)
+
+
+# Ids come from AUTOINCREMENT, so they are never reused and stay the same for a person's lifetime
+@timed_query
 def insert_teacher(name, username):
-    db = get_teachers_db()
+    db = get_db()
     cursor = db.cursor()
-    cursor.execute("SELECT MAX(id) FROM teachers")
-    max_id = cursor.fetchone()[0]
-    new_id = max_id + 1 if max_id else 1 
-    cursor.execute("INSERT INTO teachers (id, name, username) VALUES (?, ?, ?)", (new_id, name, username))
+    cursor.execute("INSERT INTO teachers (name, username) VALUES (?, ?)", (name, username))
     db.commit()
     close_db(db)
 
+@timed_query
 def insert_student(name, username, semester, department):
-    db = get_students_db()
+    db = get_db()
     cursor = db.cursor()
-    cursor.execute("SELECT MAX(id) FROM students")
-    max_id = cursor.fetchone()[0]
-    new_id = max_id + 1 if max_id else 1
-    cursor.execute("INSERT INTO students (id, name, username, semester, department) VALUES (?, ?, ?, ?, ?)",
-                   (new_id, name, username, semester, department))
+    cursor.execute("INSERT INTO students (name, username, semester, department) VALUES (?, ?, ?, ?)",
+                   (name, username, semester, department))
     db.commit()
     close_db(db)
 
+@timed_query
 def insert_subject(name, teacher_username):
-    db = get_subjects_db()
+    db = get_db()
     cursor = db.cursor()
     cursor.execute("INSERT INTO subjects (name, teacher_username) VALUES (?, ?)", (name, teacher_username))
     db.commit()
     close_db(db)
 
+@timed_query
 def is_username_assigned_to_teacher(username):
-    db = get_teachers_db()
+    db = get_db()
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM teachers WHERE username = ?", (username,))
+    cursor.execute("SELECT 1 FROM teachers WHERE username = ?", (username,))
     data = cursor.fetchone()
     close_db(db)
     return data is not None
 
+@timed_query
 def is_username_assigned_to_student(username):
-    db = get_students_db()
+    db = get_db()
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM students WHERE username = ?", (username,))
+    cursor.execute("SELECT 1 FROM students WHERE username = ?", (username,))
     data = cursor.fetchone()
     close_db(db)
     return data is not None
 
+@timed_query
 def is_subject_assigned_to_other_teacher(subject_name, teacher_username):
-    db = get_subjects_db()
+    db = get_db()
     cursor = db.cursor()
     cursor.execute("SELECT * FROM subjects WHERE name = ? AND teacher_username != ?", (subject_name, teacher_username))
     data = cursor.fetchone()
     close_db(db)
     return data is not None
 
+@timed_query
 def get_teacher_password(username):
-    db = get_teacher_passwords_db()
+    db = get_db()
     cursor = db.cursor()
     cursor.execute("SELECT password_hash FROM teacher_passwords WHERE username = ?", (username,))
     data = cursor.fetchone()
@@ -151,24 +388,22 @@ def get_teacher_password(username):
     else:
         return None
 
+@timed_query
 def set_teacher_password(username, password):
-    db = get_teacher_passwords_db()
+    db = get_db()
     cursor = db.cursor()
-    password_hash = hashlib.sha256(password.encode()).hexdigest()
+    password_hash = hash_password(password)
     cursor.execute("INSERT OR REPLACE INTO teacher_passwords (username, password_hash) VALUES (?, ?)", (username, password_hash))
     db.commit()
     close_db(db)
-    
+
+@timed_query
 def verify_teacher_password(username, password):
-    stored_password_hash = get_teacher_password(username)
-    if stored_password_hash:
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        return password_hash == stored_password_hash
-    else:
-        return False
-    
+    return _verify_and_upgrade("teacher_passwords", username, password, get_teacher_password(username))
+
+@timed_query
 def get_student_password(username):
-    db = get_student_passwords_db()
+    db = get_db()
     cursor = db.cursor()
     cursor.execute("SELECT password_hash FROM student_passwords WHERE username = ?", (username,))
     data = cursor.fetchone()
@@ -178,171 +413,351 @@ def get_student_password(username):
     else:
         return None
 
+@timed_query
 def set_student_password(username, password):
-    db = get_student_passwords_db()
+    db = get_db()
     cursor = db.cursor()
-    password_hash = hashlib.sha256(password.encode()).hexdigest()
+    password_hash = hash_password(password)
     cursor.execute("INSERT OR REPLACE INTO student_passwords (username, password_hash) VALUES (?, ?)", (username, password_hash))
     db.commit()
     close_db(db)
-    
+
+@timed_query
 def verify_student_password(username, password):
-    stored_password_hash = get_student_password(username)
-    if stored_password_hash:
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        return password_hash == stored_password_hash
-    else:
-        return False  
-   
+    return _verify_and_upgrade("student_passwords", username, password, get_student_password(username))
+
+def _verify_and_upgrade(table, username, password, stored_password_hash):
+    if not stored_password_hash or not verify_password(password, stored_password_hash):
+        return False
+
+    # Legacy SHA-256 hashes and hashes made with an older cost are replaced now that the
+    # password is known; the WHERE clause leaves a password changed meanwhile alone.
+    # The new hash is made on the verification pool, before a connection is taken.
+    if needs_rehash(stored_password_hash):
+        password_hash = rehash_password(password)
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute(f"UPDATE {table} SET password_hash = ? WHERE username = ? AND password_hash = ?",
+                       (password_hash, username, stored_password_hash))
+        db.commit()
+        close_db(db)
+    return True
+
+@timed_query
 def get_all_students():
-    db = get_students_db()
+    db = get_db()
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM students")
+    cursor.execute("SELECT id, name, username, semester, department FROM students")
     students = cursor.fetchall()
     close_db(db)
     return students
 
+# Largest number of ids bound into one IN (...) list
+DELETE_CHUNK_SIZE = 500
+
+def _delete_by_ids(table, ids):
+    # Delete the rows with the given ids in one transaction and return how many went.
+    # Password, attendance and attendance event rows go with them through the foreign keys.
+    # Students' attendance_versions rows stay, bumped by the attendance delete trigger, so a student
+    # registered again under the same username never gets a version a cached summary was made at.
+    ids = list(ids)
+    db = get_db()
+    with db:
+        cursor = db.cursor()
+        deleted = 0
+        for i in range(0, len(ids), DELETE_CHUNK_SIZE):
+            chunk = ids[i:i + DELETE_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", chunk)
+            deleted += cursor.rowcount
+    close_db(db)
+    return deleted
+
+@timed_query
+def delete_students_by_ids(student_ids):
+    return _delete_by_ids("students", student_ids)
+
 def delete_student_by_id(student_id):
-    db = get_students_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM students WHERE id = ?", (student_id,))
-    db.commit()
-    cursor.execute("UPDATE students SET id = id - 1 WHERE id > ?", (student_id,))
-    db.commit()
+    return delete_students_by_ids([student_id])
 
-    close_db(db)
-   
+@timed_query
 def get_subjects_with_teachers():
-    db = get_subjects_db()
+    db = get_db()
     cursor = db.cursor()
     cursor.execute("SELECT name, COALESCE(teacher_username, 'NO SUBJECT') FROM subjects")
     subjects = cursor.fetchall()
     close_db(db)
     return subjects
 
+@timed_query
 def delete_subject_from_db(subject_name, teacher_username):
-    db = get_subjects_db()
+    db = get_db()
     cursor = db.cursor()
     cursor.execute("DELETE FROM subjects WHERE name = ? AND teacher_username = ?", (subject_name, teacher_username))
     db.commit()
     close_db(db)
 
+@timed_query
 def get_all_teachers():
-    db = get_teachers_db()
+    db = get_db()
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM teachers")
+    cursor.execute("SELECT id, name, username FROM teachers")
     teachers = cursor.fetchall()
     close_db(db)
     return teachers
 
+@timed_query
+def delete_teachers_by_ids(teacher_ids):
+    return _delete_by_ids("teachers", teacher_ids)
+
 def delete_teacher_by_id(teacher_id):
-    db = get_teachers_db()
+    return delete_teachers_by_ids([teacher_id])
+
+# Columns the attendance table may be sorted by; anything else falls back to the username
+ATTENDANCE_SORT_COLUMNS = {
+    "student_id": "s.username",
+    "name": "s.name",
+    "department": "s.department",
+    "semester": "s.semester",
+    "classes_present": "COALESCE(a.classes_present, 0)",
+    "attendance_percentage": "COALESCE(a.attendance_percentage, 0)",
+}
+
+@timed_query
+def fetch_attendance_page(subject, department=None, semester=None, below=None, sort="student_id",
+                          descending=False, limit=50, offset=0):
+    # One page of the subject's attendance table, filtered and sorted in SQL.
+    # Returns the rows (username, name, department, semester, classes present, percentage)
+    # and the number of students matching the filters.
+    conditions, params = [], [subject]
+    if department:
+        conditions.append("s.department = ?")
+        params.append(department)
+    if semester:
+        conditions.append("s.semester = ?")
+        params.append(semester)
+    if below is not None:
+        conditions.append("COALESCE(a.attendance_percentage, 0) < ?")
+        params.append(below)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+    order = ATTENDANCE_SORT_COLUMNS.get(sort, "s.username") + (" DESC" if descending else " ASC")
+    if order.split()[0] != "s.username":
+        order += ", s.username ASC"  # Keep pages stable when sort values tie
+
+    db = get_db()
     cursor = db.cursor()
-    cursor.execute("DELETE FROM teachers WHERE id = ?", (teacher_id,))
-    db.commit()
-
-    cursor.execute("UPDATE teachers SET id = id - 1 WHERE id > ?", (teacher_id,))
-    db.commit()
+    cursor.execute(f'''SELECT COUNT(*) FROM students s
+                       LEFT JOIN attendance a ON a.student_id = s.username AND a.subject = ?
+                       {where}''', params)
+    total = cursor.fetchone()[0]
+    cursor.execute(f'''SELECT s.username, s.name, s.department, s.semester,
+                              COALESCE(a.classes_present, 0), COALESCE(a.attendance_percentage, 0)
+                       FROM students s
+                       LEFT JOIN attendance a ON a.student_id = s.username AND a.subject = ?
+                       {where}
+                       ORDER BY {order}
+                       LIMIT ? OFFSET ?''', params + [limit, offset])
+    rows = cursor.fetchall()
+    close_db(db)
+    return rows, total
 
+@timed_query
+def get_student_filters():
+    # Departments and semesters that students are registered in, for the dashboard filters
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT DISTINCT department FROM students ORDER BY department")
+    departments = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT DISTINCT semester FROM students ORDER BY semester")
+    semesters = [row[0] for row in cursor.fetchall()]
     close_db(db)
-    
-def fetch_attendance_data(database_path, teacher_username):
-    conn_attendance = sqlite3.connect(database_path)
-    c_attendance = conn_attendance.cursor()
-    c_attendance.execute('''SELECT student_id, classes_present, attendance_percentage FROM Attendance ORDER BY student_id ASC''')
-    attendance_data = c_attendance.fetchall()
-
-    # Close the attendance database connection
-    conn_attendance.close()
-
-    # Connect to the students database and fetch all students
-    conn_students = sqlite3.connect('students.db')
-    c_students = conn_students.cursor()
-    c_students.execute('''SELECT username FROM students''')
-    all_students = c_students.fetchall()
-
-    # Close the students database connection
-    conn_students.close()
-
-    # Convert fetched attendance data to a set for efficient lookup
-    present_students = set(row[0] for row in attendance_data)
-
-    # Iterate over all students and add those not present in attendance data with default values
-    for student_username in all_students:
-        student_username = student_username[0]  # Extract the username from the tuple
-        if student_username not in present_students:
-            attendance_data.append((student_username, 0, 0))  # Add default values
-
-    # Sort the attendance data by student_id (username)
-    attendance_data.sort(key=lambda x: x[0])
-
-    return attendance_data
-
-def update_classes_present_in_database(database_path, student_id, classes_present):
-    conn = sqlite3.connect(database_path)
-    c = conn.cursor()
-
-    # Check if the student already exists in the Attendance table
-    c.execute('''SELECT * FROM Attendance WHERE student_id = ?''', (student_id,))
-    student_data = c.fetchone()
-
-    if student_data:
-        # Update classes_present for the student
-        c.execute('''UPDATE Attendance SET classes_present = ? WHERE student_id = ?''',
-                  (classes_present, student_id))
-    else:
-        # Insert the student with classes_present and attendance_percentage as 0
-        c.execute('''INSERT INTO Attendance (student_id, classes_present, attendance_percentage)
-                     VALUES (?, ?, 0)''', (student_id, classes_present))
+    return departments, semesters
+
+def update_attendance_percentages(cursor, subject):
+    # Percentages are relative to all classes taken in the subject
+    cursor.execute('''SELECT SUM(classes_taken) FROM classes_taken WHERE subject = ?''', (subject,))
+    total_classes_taken = cursor.fetchone()[0] or 1  # Avoid division by zero
+    cursor.execute('''UPDATE attendance SET attendance_percentage = (classes_present / ?) * 100 WHERE subject = ?''',
+                   (total_classes_taken, subject))
+
+@timed_query
+def update_classes_present_in_database(subject, student_id, classes_present):
+    db = get_db()
+    cursor = db.cursor()
 
-    # Recalculate attendance percentage for all students
-    total_classes_taken_query = '''SELECT SUM(classes_taken) FROM ClassesTaken'''
-    c.execute(total_classes_taken_query)
-    total_classes_taken = c.fetchone()[0] or 1  # Avoid division by zero
+    # Insert the student's row for the subject, or update classes_present if it exists
+    cursor.execute('''INSERT INTO attendance (subject, student_id, classes_present) VALUES (?, ?, ?)
+                      ON CONFLICT (subject, student_id) DO UPDATE SET classes_present = excluded.classes_present''',
+                   (subject, student_id, classes_present))
 
-    update_attendance_query = '''UPDATE Attendance SET attendance_percentage = (classes_present / ?) * 100'''
-    c.execute(update_attendance_query, (total_classes_taken,))
+    # Recalculate attendance percentage for all students of the subject
+    update_attendance_percentages(cursor, subject)
 
-    conn.commit()
-    conn.close()
+    db.commit()
+    close_db(db)
 
-def get_student_attendance(database_path, student_username):
-    # Connect to the specified database
-    conn = sqlite3.connect(database_path)
-    cursor = conn.cursor()
+@timed_query
+def get_student_attendance(subject, student_username):
+    # Retrieve the attendance percentage for the student in the subject
+    return get_student_attendance_summary(student_username).get(subject)
+
+
+# Per-student attendance summaries, least recently used first.
+# Each entry is stored with the student's attendance version; it is only served while the
+# version in the database is unchanged, so writes from the recognition process are seen too.
+class AttendanceCache:
+    def __init__(self, size=1024):
+        self.size = size
+        self._entries = OrderedDict()  # student username -> (version, summary)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, student_username, version):
+        with self._lock:
+            entry = self._entries.get(student_username)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(student_username)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, student_username, version, summary):
+        with self._lock:
+            self._entries[student_username] = (version, summary)
+            self._entries.move_to_end(student_username)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+attendance_cache = AttendanceCache()
+
+@timed_query
+def get_student_attendance_summary(student_username):
+    # Attendance percentage of a student in every subject, in one query, cached until the
+    # student's attendance changes
+    db = get_db()
+    cursor = db.cursor()
+    # The version is read before the summary, so a write in between can only make the cached
+    # entry look older than it is, never newer
+    cursor.execute("SELECT version FROM attendance_versions WHERE student_id = ?", (student_username,))
+    row = cursor.fetchone()
+    version = (DATABASE, row[0] if row else 0)
+
+    summary = attendance_cache.get(student_username, version)
+    if summary is None:
+        cursor.execute("SELECT subject, attendance_percentage FROM attendance WHERE student_id = ?", (student_username,))
+        summary = dict(cursor.fetchall())
+        attendance_cache.put(student_username, version, summary)
+    close_db(db)
+    # Callers get their own copy, so they cannot change the cached entry
+    return dict(summary)
+
+@timed_query
+def get_attendance_events_since(subject, after_id, limit=500):
+    # Attendance events of a subject logged after the event with id after_id, oldest first.
+    # Each student's newest event carries their current attendance totals; older events, which
+    # a replay after a reconnect can include, carry none, since the totals they led to are gone.
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('''SELECT e.id, e.student_id, e.date, e.period, e.recorded_at,
+                             a.classes_present, a.attendance_percentage
+                      FROM attendance_events e
+                      LEFT JOIN attendance a ON a.subject = e.subject AND a.student_id = e.student_id
+                          AND NOT EXISTS (SELECT 1 FROM attendance_events newer
+                                          WHERE newer.student_id = e.student_id AND newer.subject = e.subject
+                                            AND newer.id > e.id)
+                      WHERE e.id > ? AND e.subject = ?
+                      ORDER BY e.id LIMIT ?''', (after_id, subject, limit))
+    events = cursor.fetchall()
+    close_db(db)
+    return events
+
+@timed_query
+def get_last_attendance_event_id():
+    # Where a live attendance feed starts: after everything already logged
+    db = get_db()
+    row = db.execute("SELECT MAX(id) FROM attendance_events").fetchone()
+    close_db(db)
+    return row[0] or 0
+
+# Live attendance feeds in this process wait here and are woken as soon as attendance is written
+# by this process; writes from other processes are found by the feeds polling the event log
+_attendance_written = threading.Condition()
+_attendance_generation = 0
+
+def notify_attendance_written():
+    global _attendance_generation
+    with _attendance_written:
+        _attendance_generation += 1
+        _attendance_written.notify_all()
+
+# Function to wait until attendance is written after the given generation, or the timeout passes;
+# returns the current generation
+def wait_for_attendance(generation, timeout):
+    with _attendance_written:
+        _attendance_written.wait_for(lambda: _attendance_generation != generation, timeout)
+        return _attendance_generation
+
+@timed_query
+def get_total_classes_taken(subject, teacher_username):
+    db = get_db()
+    cursor = db.cursor()
 
-    # Retrieve the attendance percentage for the student from the Attendance table
-    cursor.execute("SELECT attendance_percentage FROM Attendance WHERE student_id = ?", (student_username,))
+    cursor.execute('''SELECT classes_taken FROM classes_taken WHERE subject = ? AND teacher_username = ?''',
+                   (subject, teacher_username))
     result = cursor.fetchone()
 
-    conn.close()
+    close_db(db)
 
     if result:
         return result[0]
     else:
-        return None
-    
-def get_total_classes_taken(database_path, teacher_username):
-    conn = sqlite3.connect(database_path)
-    c = conn.cursor()
+        return 0  # Return 0 if no classes taken yet
 
-    c.execute('''SELECT classes_taken FROM ClassesTaken WHERE teacher_name = ?''', (teacher_username,))
-    result = c.fetchone()
 
-    conn.close()
+def get_cache_version(cursor, name):
+    # Version of a cached table group from cache_versions; it changes whenever the tables do
+    cursor.execute("SELECT version FROM cache_versions WHERE name = ?", (name,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
 
-    if result:
-        return result[0]
-    else:
-        return 0  # Return 0 if no classes taken yet
 
+# Teacher to subject map per database file, with the subjects version it was built from
+_subject_maps = {}
+_subject_maps_lock = threading.Lock()
 
+@timed_query
 def get_teacher_subject_map():
-    return {
-        "teacher01": {"subject": "DCC", "database": "dcc_attendance.db"},
-        "teacher02": {"subject": "IEFT", "database": "ieft_attendance.db"},
-        "teacher03": {"subject": "CD", "database": "cd_attendance.db"},
-        "teacher04": {"subject": "AAD", "database": "aad_attendance.db"},
-        "teacher05": {"subject": "CGIP", "database": "cgip_attendance.db"},
-    }
+    # Map each teacher username to the subject assigned to them in the subjects table, e.g.
+    # {"teacher01": {"subject": "DCC", "subjects": ["DCC"]}}. A teacher with several subjects
+    # gets the first one assigned as "subject". The map is rebuilt only when the subjects
+    # table has changed, which costs one primary-key lookup to check; it is shared between
+    # callers, so do not modify it.
+    db = get_db()
+    cursor = db.cursor()
+    version = get_cache_version(cursor, "subjects")
+
+    with _subject_maps_lock:
+        cached = _subject_maps.get(DATABASE)
+    if cached is not None and cached[0] == version:
+        close_db(db)
+        return cached[1]
+
+    # As with attendance, the version is read first so a change in between only causes a rebuild
+    cursor.execute("SELECT teacher_username, name FROM subjects WHERE teacher_username IS NOT NULL ORDER BY id")
+    teacher_subject_map = {}
+    for teacher_username, subject in cursor.fetchall():
+        teacher_data = teacher_subject_map.setdefault(teacher_username, {"subject": subject, "subjects": []})
+        teacher_data["subjects"].append(subject)
+    close_db(db)
 
+    with _subject_maps_lock:
+        _subject_maps[DATABASE] = (version, teacher_subject_map)
+    return teacher_subject_map
@@ -0,0 +1,175 @@
+import os
+import csv
+import sys
+import shutil
+import zipfile
+import argparse
+from database import get_db, close_db, init_db
+
+# Columns every row must have, per kind of person
+REQUIRED_COLUMNS = {
+    "student": ["name", "username", "semester", "department"],
+    "teacher": ["name", "username"],
+}
+TABLES = {"student": "students", "teacher": "teachers"}
+
+# Same image folders the recognizer loads its gallery from (face/face.py)
+IMAGE_DIRS = {
+    "student": "face/images/student_image",
+    "teacher": "face/images/teacher_image",
+}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 100
+
+
+# Function to read a CSV a chunk of rows at a time, so a large file is never held in memory
+def read_chunks(csv_file, chunk_size=CHUNK_SIZE):
+    chunk = []
+    for line_number, row in enumerate(csv.DictReader(csv_file), start=2):
+        chunk.append((line_number, row))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Function to find which of the given usernames are already registered, in one query
+def find_existing_usernames(cursor, kind, usernames):
+    if not usernames:
+        return set()
+    placeholders = ", ".join("?" * len(usernames))
+    cursor.execute(f"SELECT username FROM {TABLES[kind]} WHERE username IN ({placeholders})", list(usernames))
+    return {row[0] for row in cursor.fetchall()}
+
+
+# Function to insert one chunk of people in a single transaction.
+# Rows with missing fields, usernames repeated in the file and usernames that already exist are
+# skipped and reported; the rest are inserted together.
+def import_chunk(db, kind, chunk, seen, report):
+    columns = REQUIRED_COLUMNS[kind]
+    valid = []
+    for line_number, row in chunk:
+        values = [(row.get(column) or "").strip() for column in columns]
+        username = values[1]
+        if not all(values):
+            missing = [column for column, value in zip(columns, values) if not value]
+            error = f"missing {', '.join(missing)}"
+        elif username in seen:
+            error = f"username {username} repeated in the file"
+        else:
+            seen.add(username)
+            valid.append(values)
+            continue
+        report["skipped"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append(f"line {line_number}: {error}")
+
+    with db:
+        cursor = db.cursor()
+        existing = find_existing_usernames(cursor, kind, [values[1] for values in valid])
+        new_rows = [values for values in valid if values[1] not in existing]
+        # OR IGNORE covers a username registered by someone else since the check
+        changes = db.total_changes
+        cursor.executemany(f"INSERT OR IGNORE INTO {TABLES[kind]} ({', '.join(columns)}) "
+                           f"VALUES ({', '.join('?' * len(columns))})", new_rows)
+        inserted = db.total_changes - changes
+
+    for username in sorted(existing):
+        report["skipped"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append(f"username {username} already exists")
+    report["inserted"] += inserted
+    report["imported_usernames"].update(values[1] for values in new_rows)
+
+
+# Function to copy the photos of imported people out of a zip into the recognizer's image folder.
+# Photos are named after the username, e.g. stu042.jpg; photos of anyone else are ignored.
+def extract_photos(photos_zip, usernames, image_dir):
+    os.makedirs(image_dir, exist_ok=True)
+    extracted = 0
+    with zipfile.ZipFile(photos_zip) as archive:
+        for member in archive.infolist():
+            file_name = os.path.basename(member.filename)
+            username, extension = os.path.splitext(file_name)
+            if member.is_dir() or extension.lower() not in IMAGE_EXTENSIONS or username not in usernames:
+                continue
+            with archive.open(member) as source, open(os.path.join(image_dir, file_name), 'wb') as target:
+                shutil.copyfileobj(source, target)
+            extracted += 1
+    return extracted
+
+
+# Function to encode the new photos into the recognizer's embedding store in a process pool
+def encode_photos(image_dir, workers):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "face"))
+    from embedding_store import sync_store, row_names
+
+    known_faces, entries = sync_store(image_dir, workers=workers)
+    return len(set(row_names(entries)))
+
+
+# Function to import people from a CSV stream, optionally with a zip of their photos.
+# Yields a progress report after every chunk and once more when the photos are done;
+# the last report is the final one.
+def import_people(csv_file, kind="student", photos_zip=None, chunk_size=CHUNK_SIZE, encode_workers=None,
+                  image_dir=None):
+    if kind not in REQUIRED_COLUMNS:
+        raise ValueError(f"Unknown kind of person: {kind}")
+
+    report = {"kind": kind, "rows": 0, "inserted": 0, "skipped": 0, "errors": [], "imported_usernames": set(),
+              "photos": 0, "encoded_people": None, "done": False}
+    seen = set()
+
+    db = get_db()
+    try:
+        for chunk in read_chunks(csv_file, chunk_size):
+            report["rows"] += len(chunk)
+            import_chunk(db, kind, chunk, seen, report)
+            yield report
+    finally:
+        close_db(db)
+
+    if photos_zip is not None and report["imported_usernames"]:
+        image_dir = image_dir or IMAGE_DIRS[kind]
+        report["photos"] = extract_photos(photos_zip, report["imported_usernames"], image_dir)
+        if report["photos"]:
+            report["encoded_people"] = encode_photos(image_dir, encode_workers or os.cpu_count())
+
+    report["done"] = True
+    yield report
+
+
+# Function to make a report JSON friendly for the import endpoint
+def report_summary(report):
+    summary = dict(report)
+    summary.pop("imported_usernames")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import students or teachers from a CSV file")
+    parser.add_argument("csv", help='CSV with "name,username" columns, plus "semester,department" for students')
+    parser.add_argument("--kind", choices=sorted(REQUIRED_COLUMNS), default="student")
+    parser.add_argument("--photos", help="zip of face photos named <username>.jpg")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=None, help="processes used to encode the photos")
+    args = parser.parse_args()
+
+    init_db()
+    with open(args.csv, newline='') as csv_file:
+        for report in import_people(csv_file, args.kind, args.photos, args.chunk_size, args.workers):
+            if not report["done"]:
+                print(f"{report['rows']} rows read, {report['inserted']} imported, {report['skipped']} skipped")
+
+    for error in report["errors"]:
+        print(error)
+    print(f"Imported {report['inserted']} of {report['rows']} {args.kind}s")
+    if args.photos:
+        print(f"Photos: {report['photos']}, people in the {args.kind} gallery: {report['encoded_people']}")
+
+
+if __name__ == "__main__":
+    main()
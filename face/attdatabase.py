@@ -1,67 +1,143 @@
+import os
+import sys
+import time
 import sqlite3
+import threading
+from datetime import datetime
 
-# Function to initialize subject databases
-def initialize_subject_databases(teacher_subject_map):
-    for teacher_name, data in teacher_subject_map.items():
-        database_name = data["database"]
-        conn = sqlite3.connect(database_name)
-        c = conn.cursor()
-
-        # Create a table to track teacher's classes taken
-        c.execute('''CREATE TABLE IF NOT EXISTS ClassesTaken
-                     (teacher_name TEXT, subject TEXT, classes_taken REAL)''')
-
-        # Create a table to track student attendance
-        c.execute('''CREATE TABLE IF NOT EXISTS Attendance
-                     (student_id TEXT, classes_present REAL, attendance_percentage REAL)''')
-
-        conn.commit()
-        conn.close()
-
-# Function to insert teacher's classes taken
-def insert_classes_taken(database_path, teacher_name, subject):
-    conn = sqlite3.connect(database_path)
-    c = conn.cursor()
-
-    # Check if the teacher already exists in the table
-    c.execute('''SELECT classes_taken FROM ClassesTaken WHERE teacher_name = ? AND subject = ?''', (teacher_name, subject))
-    result = c.fetchone()
-
-    if result:
-        # If teacher exists, update the classes_taken count
-        classes_taken = result[0] + 1
-        c.execute('''UPDATE ClassesTaken SET classes_taken = ? WHERE teacher_name = ? AND subject = ?''',
-                  (classes_taken, teacher_name, subject))
-    else:
-        # If teacher doesn't exist, insert a new row
-        c.execute('''INSERT INTO ClassesTaken (teacher_name, subject, classes_taken) VALUES (?, ?, 1)''',
-                  (teacher_name, subject))
-
-    conn.commit()
-    conn.close()
-
-# Function to insert student attendance and update percentage
-def insert_attendance(database_path, student_id):
-    conn = sqlite3.connect(database_path)
-    c = conn.cursor()
-
-    # Update classes_present for the student
-    c.execute('''SELECT classes_present FROM Attendance WHERE student_id = ?''', (student_id,))
-    result = c.fetchone()
-
-    if result:
-        classes_present = result[0] + 1
-        c.execute('''UPDATE Attendance SET classes_present = ? WHERE student_id = ?''',
-                  (classes_present, student_id))
-    else:
-        c.execute('''INSERT INTO Attendance (student_id, classes_present) VALUES (?, 1)''', (student_id,))
-
-    # Calculate and update attendance percentage
-    c.execute('''SELECT SUM(classes_taken) FROM ClassesTaken''')  # Sum of all classes taken by teachers
-    total_classes_taken = c.fetchone()[0] or 1  # Avoid division by zero
-
-    c.execute('''UPDATE Attendance SET attendance_percentage = (classes_present / ?) * 100''',
-              (total_classes_taken,))
-
-    conn.commit()
-    conn.close()
\ No newline at end of file
+# database.py lives in the project root, one level above this directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import get_db, close_db, connect_db, init_db, update_attendance_percentages, get_teacher_subject_map, \
+    notify_attendance_written
+import metrics
+
+write_seconds = metrics.histogram("attendance_write_seconds", "Time to write a batch of attendance events")
+marks_total = metrics.counter("attendance_marks_total",
+                              "Attendance marks, new or skipped as already recorded or not a student", ("result",))
+
+# Function to record that a teacher held a class in a period.
+# A class is counted once per (subject, teacher, date, period), however often it is started;
+# returns whether it was new.
+def insert_classes_taken(teacher_name, subject, date, period):
+    db = get_db()
+    with db:
+        c = db.cursor()
+        # The classes_held trigger counts a new class in classes_taken
+        c.execute('''INSERT OR IGNORE INTO classes_held (subject, teacher_username, date, period)
+                     VALUES (?, ?, ?, ?)''', (subject, teacher_name, date, period))
+        held = c.rowcount == 1
+        if held:
+            update_attendance_percentages(c, subject)
+    close_db(db)
+    return held
+
+# Function to append attendance events and keep the attendance summary in step.
+# Each event is (student_id, subject, date, period, recorded_at); events already in the log are
+# ignored by the unique key, and faces that are not registered students are skipped, so only
+# new events count towards classes_present.
+# Returns the number of events that were new.
+def insert_attendance_events(db, events):
+    start = time.perf_counter()
+    c = db.cursor()
+    new_events = {}
+    for event in events:
+        c.execute('''INSERT OR IGNORE INTO attendance_events (student_id, subject, date, period, recorded_at)
+                     SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM students WHERE username = ?)''',
+                  event + (event[0],))
+        if c.rowcount == 1:
+            key = (event[1], event[0])
+            new_events[key] = new_events.get(key, 0) + 1
+
+    for (subject, student_id), count in new_events.items():
+        c.execute('''INSERT INTO attendance (subject, student_id, classes_present) VALUES (?, ?, ?)
+                     ON CONFLICT (subject, student_id) DO UPDATE SET classes_present = classes_present + excluded.classes_present''',
+                  (subject, student_id, count))
+
+    # Recalculate attendance percentages once per subject for the whole batch
+    for subject in {subject for subject, student_id in new_events}:
+        update_attendance_percentages(c, subject)
+
+    inserted = sum(new_events.values())
+    write_seconds.observe(time.perf_counter() - start)
+    marks_total.inc("new", amount=inserted)
+    marks_total.inc("skipped", amount=len(events) - inserted)
+    return inserted
+
+# Function to insert student attendance for one period and update percentage
+def insert_attendance(student_id, subject, date, period, recorded_at=None):
+    recorded_at = recorded_at or datetime.now().isoformat(timespec="seconds")
+    db = get_db()
+    with db:
+        inserted = insert_attendance_events(db, [(student_id, subject, date, period, recorded_at)])
+    close_db(db)
+    if inserted:
+        notify_attendance_written()
+    return inserted == 1
+
+
+# Batched attendance writer.
+# Recognitions from any number of threads are queued in memory and written once per flush
+# interval in a single transaction on one connection that stays open, with attendance
+# percentages recomputed once per batch instead of once per student.
+# Repeated marks for the same student and period are dropped by the event log's unique key.
+class AttendanceWriter:
+    def __init__(self, flush_interval=1.0, background=True):
+        self.flush_interval = flush_interval
+        self._pending = {}  # (student_id, subject, date, period) -> recorded_at
+        self._db = None
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        if background:
+            self._thread = threading.Thread(target=self._flush_loop, name="attendance-writer", daemon=True)
+            self._thread.start()
+
+    # Function to queue one attendance mark for a period; it is written on the next flush
+    def record(self, student_id, subject, date, period, recorded_at=None):
+        recorded_at = recorded_at or datetime.now().isoformat(timespec="seconds")
+        with self._pending_lock:
+            self._pending.setdefault((student_id, subject, date, period), recorded_at)
+
+    # Function to write everything queued so far, returning the number of new attendance marks
+    def flush(self):
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            try:
+                if self._db is None:
+                    # A connection of its own, since flushes come from the background thread or from close()
+                    self._db = connect_db()
+                with self._db:
+                    inserted = insert_attendance_events(
+                        self._db, [key + (recorded_at,) for key, recorded_at in pending.items()])
+                # Live attendance feeds are woken once the batch is committed
+                if inserted:
+                    notify_attendance_written()
+                return inserted
+            except sqlite3.Error as e:
+                print("Error writing attendance, Error:", e)
+                # Put the batch back so it is retried on the next flush
+                with self._pending_lock:
+                    for key, recorded_at in pending.items():
+                        self._pending.setdefault(key, recorded_at)
+                return 0
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    # Function to stop the background flush, write what is left and close the connection
+    def close(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+        with self._flush_lock:
+            if self._db is not None:
+                close_db(self._db)
+                self._db = None
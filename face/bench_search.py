@@ -0,0 +1,61 @@
+import argparse
+import time
+import numpy as np
+from search_index import ENCODING_SIZE, create_index
+
+
+# Function to build a synthetic gallery that looks like dlib encodings:
+# identities sit about 1.1 apart and samples of one identity about 0.3 apart
+def make_gallery(identities, samples_per_identity, random):
+    centers = random.normal(0, 0.07, (identities, ENCODING_SIZE)).astype(np.float32)
+    gallery = np.repeat(centers, samples_per_identity, axis=0)
+    gallery += random.normal(0, 0.02, gallery.shape).astype(np.float32)
+    return centers, gallery
+
+
+# Function to run every query through an index in frame-sized batches, returning top-1 rows and queries/sec
+def run_queries(index, queries, batch_size):
+    best_rows = []
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        best_rows.append(index.search(queries[i:i + batch_size], 1)[1][:, 0])
+    elapsed = time.perf_counter() - start
+    return np.concatenate(best_rows), len(queries) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare approximate identity search with the exact baseline")
+    parser.add_argument("--identities", type=int, default=20000)
+    parser.add_argument("--samples", type=int, default=2, help="encodings per identity")
+    parser.add_argument("--queries", type=int, default=3000)
+    parser.add_argument("--batch-size", type=int, default=60, help="faces per frame")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random = np.random.default_rng(args.seed)
+    centers, gallery = make_gallery(args.identities, args.samples, random)
+    queries = centers[random.choice(len(centers), args.queries)]
+    queries = queries + random.normal(0, 0.02, queries.shape).astype(np.float32)
+
+    print(f"Gallery: {len(gallery)} encodings, {args.identities} identities, {args.queries} queries")
+
+    exact = create_index("exact", gallery)
+    exact_rows, exact_qps = run_queries(exact, queries, args.batch_size)
+    print(f"{'backend':<18}{'recall@1':>10}{'queries/s':>12}{'speedup':>10}")
+    print(f"{'exact':<18}{1.0:>10.3f}{exact_qps:>12.0f}{1.0:>10.1f}")
+
+    start = time.perf_counter()
+    ivf = create_index("ivf", gallery, nlist=args.nlist, seed=args.seed)
+    print(f"(ivf: {len(ivf.centroids)} clusters trained in {time.perf_counter() - start:.2f}s)")
+
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        rows, qps = run_queries(ivf, queries, args.batch_size)
+        recall = float(np.mean(rows == exact_rows))
+        print(f"{'ivf nprobe=' + str(nprobe):<18}{recall:>10.3f}{qps:>12.0f}{qps / exact_qps:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import time
+import cv2
+import numpy as np
+import face_recognition
+
+
+# Per-camera detection settings.
+# detect_scale: detection runs on a copy of the frame resized by this factor; encoding still uses full resolution.
+# motion_threshold: mean absolute pixel change (0-255) below which a frame is skipped; 0 disables motion gating.
+# keyframe_interval: a frame is processed at least this often even without motion, so seated students are seen.
+# min_face_size / max_face_size: target face height in pixels as seen by the detector after upsampling;
+# the upsample count moves between min_upsample and max_upsample to keep faces in that range.
+class DetectionConfig:
+    def __init__(self, detect_scale=0.5, motion_threshold=2.0, keyframe_interval=25, upsample=1,
+                 min_upsample=0, max_upsample=2, min_face_size=80, max_face_size=200, motion_width=160):
+        self.detect_scale = detect_scale
+        self.motion_threshold = motion_threshold
+        self.keyframe_interval = keyframe_interval
+        self.upsample = upsample
+        self.min_upsample = min_upsample
+        self.max_upsample = max_upsample
+        self.min_face_size = min_face_size
+        self.max_face_size = max_face_size
+        self.motion_width = motion_width
+
+
+# Function to make the downscaled copy of a frame that faces are detected on.
+# The pipeline makes it before handing the frame to a detection worker, so only the small copy
+# is sent between processes.
+def scale_down(frame, detect_scale):
+    if detect_scale == 1:
+        return frame
+    return cv2.resize(frame, (0, 0), fx=detect_scale, fy=detect_scale, interpolation=cv2.INTER_AREA)
+
+
+# Function to find the faces in a downscaled frame.
+# Runs in the detection worker pool; returns the face locations and the time spent in milliseconds.
+def locate_faces(small_frame, upsample):
+    start = time.perf_counter()
+    face_locations = face_recognition.face_locations(small_frame, number_of_times_to_upsample=upsample)
+    return face_locations, (time.perf_counter() - start) * 1000
+
+
+# Function to map face locations found on a downscaled copy back to the full-resolution frame
+def scale_up(face_locations, detect_scale, frame_shape):
+    height, width = frame_shape[:2]
+    return [(max(0, int(top / detect_scale)), min(width, int(right / detect_scale)),
+             min(height, int(bottom / detect_scale)), max(0, int(left / detect_scale)))
+            for top, right, bottom, left in face_locations]
+
+
+# Detection front-end state for one camera: motion gating against the previous frame and
+# the upsample count adapted to the size of the faces being found.
+class AdaptiveDetector:
+    def __init__(self, config=None):
+        self.config = config or DetectionConfig()
+        self.upsample = self.config.upsample
+        self._previous = None
+        self._frames_since_processed = 0
+
+    # Function to decide whether a frame changed enough to be worth detecting.
+    # Returns the decision and the measured pixel delta.
+    def has_motion(self, frame):
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.config.motion_width / width)
+        thumbnail = cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        if thumbnail.ndim == 3:
+            thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+
+        previous, self._previous = self._previous, thumbnail
+        if previous is None or previous.shape != thumbnail.shape:
+            self._frames_since_processed = 0
+            return True, float("inf")
+
+        delta = float(cv2.absdiff(previous, thumbnail).mean())
+        self._frames_since_processed += 1
+        if delta >= self.config.motion_threshold or self._frames_since_processed >= self.config.keyframe_interval:
+            self._frames_since_processed = 0
+            return True, delta
+        return False, delta
+
+    # Function to adjust upsampling from the full-resolution faces found in a frame:
+    # small faces need more upsampling to be found, large ones can do with less.
+    def observe(self, face_locations):
+        if not face_locations:
+            return
+        heights = [bottom - top for top, right, bottom, left in face_locations]
+        seen_size = np.median(heights) * self.config.detect_scale * (2 ** self.upsample)
+
+        if seen_size < self.config.min_face_size and self.upsample < self.config.max_upsample:
+            self.upsample += 1
+        elif seen_size > self.config.max_face_size and self.upsample > self.config.min_upsample:
+            self.upsample -= 1
@@ -0,0 +1,224 @@
+import os
+import json
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import face_templates
+from face_templates import encode_best_face, build_templates
+
+try:
+    import fcntl
+except ImportError:  # Windows: stores are still written atomically, just not locked
+    fcntl = None
+
+ENCODING_SIZE = 128
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Generated stores live next to the image folders, one sub-directory per folder
+EMBEDDING_STORE_DIR = "face/embeddings"
+
+
+# Function to work out where the store for an image directory is kept
+def get_store_dir(known_faces_dir):
+    return os.path.join(EMBEDDING_STORE_DIR, os.path.basename(os.path.normpath(known_faces_dir)))
+
+
+def _store_files(store_dir):
+    return os.path.join(store_dir, "encodings.npy"), os.path.join(store_dir, "index.json")
+
+
+# Function to load a store from disk.
+# The encodings come back memory-mapped, so nothing is read until it is used.
+# Each index entry describes one image: its path, size and mtime plus the rows it owns.
+def load_store(store_dir):
+    matrix_path, index_path = _store_files(store_dir)
+    empty = np.empty((0, ENCODING_SIZE), dtype=np.float32), []
+
+    if not (os.path.exists(matrix_path) and os.path.exists(index_path)):
+        return empty
+
+    try:
+        with open(index_path) as f:
+            entries = json.load(f)
+        matrix = np.load(matrix_path, mmap_mode='r')
+    except (OSError, ValueError):
+        return empty
+
+    # A store that does not add up is treated as missing and rebuilt
+    if matrix.ndim != 2 or matrix.shape[1] != ENCODING_SIZE or matrix.dtype != np.float32 \
+            or sum(entry["count"] for entry in entries) != len(matrix):
+        return empty
+
+    return matrix, entries
+
+
+# Function to write a file atomically through a temporary file of its own in the same directory,
+# so neither a crash nor another process writing the same file leaves half a file in its place
+def _write_atomic(path, mode, write):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+# Function to hold a store's lock, so processes syncing the same store (the web app, the
+# recognition service, face.py and enrollment imports) take turns at reading and rewriting it
+@contextmanager
+def store_lock(store_dir):
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, ".lock"), 'w') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+# Function to write a store atomically so a crash never leaves half a store behind
+def save_store(store_dir, matrix, entries):
+    os.makedirs(store_dir, exist_ok=True)
+    matrix_path, index_path = _store_files(store_dir)
+    _write_atomic(matrix_path, 'wb', lambda f: np.save(f, np.ascontiguousarray(matrix, dtype=np.float32)))
+    _write_atomic(index_path, 'w', lambda f: json.dump(entries, f))
+
+
+# Function to list the images in a directory together with the stat data used as the cache key.
+# An image is named after its file ("<username>.jpg"), or after its folder when a person has
+# several photos ("<username>/1.jpg", "<username>/2.jpg", ...).
+def scan_images(known_faces_dir, name=None):
+    images = []
+    for entry in os.scandir(known_faces_dir):
+        if entry.is_dir() and name is None:
+            images.extend(scan_images(entry.path, entry.name))
+        elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            stat = entry.stat()
+            images.append({"path": entry.path, "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                           "name": name or os.path.splitext(entry.name)[0]})
+    images.sort(key=lambda image: image["path"])
+    return images
+
+
+# Function to encode the best face in a single image, returning its encodings and quality
+def encode_image(image_path):
+    return encode_best_face(image_path)
+
+
+# Function to bring the store for an image directory up to date.
+# Each entry keeps the quality of its face, for building templates (see face_templates.py).
+# Only images whose path, size or mtime changed since the last run are re-encoded;
+# when nothing changed the memory-mapped store is returned untouched.
+# With workers set (even 1), the changed images are encoded in a process pool of that size, so a
+# recognizer syncing in the background never encodes on one of its own threads; with None they are
+# encoded in this process.
+def sync_store(known_faces_dir, store_dir=None, workers=None):
+    store_dir = store_dir or get_store_dir(known_faces_dir)
+    with store_lock(store_dir):
+        return _sync_store(known_faces_dir, store_dir, workers)
+
+
+def _sync_store(known_faces_dir, store_dir, workers):
+    matrix, entries = load_store(store_dir)
+    cached = {entry["path"]: entry for entry in entries}
+
+    images = scan_images(known_faces_dir)
+    unchanged = {}
+    for image in images:
+        entry = cached.get(image["path"])
+        # Entries from before quality scoring held every face in the image, so they are redone
+        if entry and entry["size"] == image["size"] and entry["mtime"] == image["mtime"] and "quality" in entry:
+            unchanged[image["path"]] = matrix[entry["start"]:entry["start"] + entry["count"]]
+
+    if len(unchanged) == len(images) == len(entries):
+        return matrix, entries
+
+    changed_paths = [image["path"] for image in images if image["path"] not in unchanged]
+    if workers and changed_paths:
+        with ProcessPoolExecutor(workers) as executor:
+            encoded = dict(zip(changed_paths, executor.map(encode_image, changed_paths, chunksize=8)))
+    else:
+        encoded = {path: encode_image(path) for path in changed_paths}
+
+    blocks = []
+    new_entries = []
+    offset = 0
+    for image in images:
+        rows = unchanged.get(image["path"])
+        if rows is None:
+            face_encodings, quality = encoded[image["path"]]
+            if not face_encodings:
+                print(f"No face found in {os.path.basename(image['path'])}")
+            rows = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        else:
+            quality = cached[image["path"]]["quality"]
+
+        new_entries.append(dict(image, start=offset, count=len(rows), quality=quality))
+        blocks.append(rows)
+        offset += len(rows)
+
+    matrix = np.concatenate(blocks) if blocks else np.empty((0, ENCODING_SIZE), dtype=np.float32)
+    save_store(store_dir, matrix, new_entries)
+    return load_store(store_dir)
+
+
+# Function to expand the per-image entries into one name per encoding row
+def row_names(entries):
+    names = []
+    for entry in entries:
+        names.extend([entry["name"]] * entry["count"])
+    return names
+
+
+def _template_files(store_dir):
+    return os.path.join(store_dir, "templates.npy"), os.path.join(store_dir, "templates.json")
+
+
+# Function to fingerprint the samples and settings templates are built from
+def _templates_key(entries):
+    settings = [face_templates.TEMPLATES_PER_IDENTITY, face_templates.TEMPLATE_MODE, face_templates.MIN_QUALITY]
+    samples = [[entry["path"], entry["size"], entry["mtime"], entry["quality"]] for entry in entries]
+    return hashlib.sha1(json.dumps([settings, samples]).encode()).hexdigest()
+
+
+# Function to load saved templates, or None when they are missing or were built from other samples
+def _load_templates(store_dir, key):
+    matrix_path, index_path = _template_files(store_dir)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get("key") != key:
+            return None
+        matrix = np.load(matrix_path)
+    except (OSError, ValueError):
+        return None
+    if matrix.ndim != 2 or matrix.shape[1] != ENCODING_SIZE or len(matrix) != len(index["names"]):
+        return None
+    return matrix.astype(np.float32, copy=False), index["names"]
+
+
+# Function to write templates atomically next to the store they were built from
+def _save_templates(store_dir, matrix, names, key):
+    os.makedirs(store_dir, exist_ok=True)
+    matrix_path, index_path = _template_files(store_dir)
+    _write_atomic(matrix_path, 'wb', lambda f: np.save(f, np.ascontiguousarray(matrix, dtype=np.float32)))
+    _write_atomic(index_path, 'w', lambda f: json.dump({"key": key, "names": names}, f))
+
+
+# Function to bring the store for an image directory up to date and return the templates of
+# every identity in it (see face_templates.py), with one name per template row and the store's entries.
+# Only the templates are kept in memory, not every sample. They are saved next to the store
+# and rebuilt only when its samples or the template settings change.
+def sync_templates(known_faces_dir, store_dir=None, workers=None):
+    store_dir = store_dir or get_store_dir(known_faces_dir)
+    with store_lock(store_dir):
+        matrix, entries = _sync_store(known_faces_dir, store_dir, workers)
+        key = _templates_key(entries)
+
+        templates = _load_templates(store_dir, key)
+        if templates is None:
+            templates = build_templates(matrix, entries)
+            _save_templates(store_dir, templates[0], templates[1], key)
+    return templates[0], templates[1], entries
@@ -1,163 +1,130 @@
 import os
+import time
 import cv2
-import face_recognition
-from attdatabase import initialize_subject_databases, insert_classes_taken, insert_attendance
+import numpy as np
+from embedding_store import sync_templates
+from matcher import FaceMatcher, MATCH_MIN_MARGIN
+from gallery import Gallery
+from detection import DetectionConfig
+from pipeline import FramePipeline
+from tracker import FaceTracker
+from session import AttendanceSession
+from presence import presence_cache
+from attdatabase import init_db, get_teacher_subject_map, AttendanceWriter
+from timetable import load_timetable
 from datetime import datetime
 
-# Function to load known faces of both students and teachers
-def load_known_faces(known_faces_dir):
-    known_faces = []
-    known_face_names = []
+KNOWN_FACES_DIR_STUDENTS = "face/images/student_image"  # Directory containing known student faces
+KNOWN_FACES_DIR_TEACHERS = "face/images/teacher_image"  # Directory containing known teacher faces
+
+# Define the schedule for each period
+PERIOD_SCHEDULE = [
+    {"start_time": "09:20", "end_time": "10:20"},
+    {"start_time": "10:21", "end_time": "11:15"},
+    {"start_time": "11:25", "end_time": "13:09"},
+    {"start_time": "13:10", "end_time": "14:10"},
+    {"start_time": "14:11", "end_time": "15:10"},
+    {"start_time": "15:11", "end_time": "22:10"},
+]
+
+# Function to load the student and teacher galleries into one matcher.
+# Encodings come from the on-disk embedding store, so only new or changed images are encoded,
+# and each person is reduced to the saved templates built from their best samples.
+# Use the "ivf" search backend for campus-scale galleries (see bench_search.py for recall/speed).
+def load_gallery(search_backend="exact", tolerance=0.5, min_margin=MATCH_MIN_MARGIN):
+    known_faces_students, known_face_names_students, _ = sync_templates(KNOWN_FACES_DIR_STUDENTS)
+    known_faces_teachers, known_face_names_teachers, _ = sync_templates(KNOWN_FACES_DIR_TEACHERS)
+
+    # Build the matcher once; the gallery matrix is reused for every frame
+    matcher = FaceMatcher(np.concatenate([known_faces_students, known_faces_teachers]),
+                          known_face_names_students + known_face_names_teachers,
+                          tolerance=tolerance, min_margin=min_margin, backend=search_backend)
+    return matcher, known_face_names_students, known_face_names_teachers
 
-    for filename in os.listdir(known_faces_dir):
-        if filename.endswith(('.jpg', '.jpeg', '.png')):
-            face_image = face_recognition.load_image_file(os.path.join(known_faces_dir, filename))
-            face_encodings = face_recognition.face_encodings(face_image, model="large")
-
-            if len(face_encodings) > 0:
-                known_faces.extend(face_encodings)
-                known_face_names.extend([os.path.splitext(filename)[0]] * len(face_encodings))
-            else:
-                print(f"No face found in {filename}")
-
-    return known_faces, known_face_names
-
-# Function to recognize both students and teachers
-def recognize_faces(known_faces, known_face_names, test_image):
-    face_locations = face_recognition.face_locations(test_image, number_of_times_to_upsample=2)
-    face_encodings = face_recognition.face_encodings(test_image, face_locations, model="large")
+if __name__ == "__main__":
+    # Create or initialize the database
+    init_db()
 
-    recognized_faces = set()
+    # Photos added, changed or removed while the recognizer runs, and students deleted on the
+    # admin dashboard, are applied to the live gallery without a restart
+    gallery = Gallery(KNOWN_FACES_DIR_STUDENTS, KNOWN_FACES_DIR_TEACHERS, min_margin=MATCH_MIN_MARGIN, workers=1)
+    gallery.start()
+    matcher, known_face_names_students, known_face_names_teachers = \
+        gallery.matcher, gallery.student_names, gallery.teacher_names
 
-    for face_encoding in face_encodings:
-        matches = face_recognition.compare_faces(known_faces, face_encoding, tolerance=0.5)
-        name = "Unknown"
+    # Recognitions are written in one transaction per second rather than one per student
+    attendance_writer = AttendanceWriter(flush_interval=1.0)
 
-        if any(matches):
-            matched_names = [known_face_names[i] for i, match in enumerate(matches) if match]
-            recognized_faces.update(matched_names)
+    # Recognition pipeline settings; None uses every available core
+    detect_workers = None
+    encode_workers = None
+    frame_queue_size = 4
 
-    return recognized_faces
+    # Detection settings for the classroom camera: detect on a half-size copy, skip frames without motion
+    detection_config = DetectionConfig(detect_scale=0.5, motion_threshold=2.0, upsample=1, max_upsample=2)
 
-if __name__ == "__main__":
-    known_faces_dir_students = "face/images/student_image"  # Directory containing known student faces
-    known_faces_dir_teachers = "face/images/teacher_image"  # Directory containing known teacher faces
-    known_faces_students, known_face_names_students = load_known_faces(known_faces_dir_students)
-    known_faces_teachers, known_face_names_teachers = load_known_faces(known_faces_dir_teachers)
-
-    # Map each teacher name to a subject and corresponding database name
-    teacher_subject_map = {
-        "teacher01": {"subject": "DCC", "database": "dcc_attendance.db"},
-        "teacher02": {"subject": "IEFT", "database": "ieft_attendance.db"},
-        "teacher03": {"subject": "CD", "database": "cd_attendance.db"},
-        "teacher04": {"subject": "AAD", "database": "aad_attendance.db"},
-        "teacher05": {"subject": "CGIP", "database": "cgip_attendance.db"},
-        "teacher06": {"subject": "MP", "database": "mp_attendance.db"},
-        "teacher07": {"subject": "NL", "database": "nl_attendance.db"},
-        # Add more mappings as needed
-    }
+    # Tracked faces with a confident identity are only re-encoded every reencode_interval frames
+    reencode_interval = 50
 
-    # Create or initialize the database
-    initialize_subject_databases(teacher_subject_map)
-
-    # Define the schedule for each period
-    period_schedule = [
-        {"start_time": "09:20", "end_time": "10:20"},
-        {"start_time": "10:21", "end_time": "11:15"},
-        {"start_time": "11:25", "end_time": "13:09"},
-        {"start_time": "13:10", "end_time": "14:10"},
-        {"start_time": "14:11", "end_time": "15:10"},
-        {"start_time": "15:11", "end_time": "22:10"},
-    ]
+    # Room this webcam watches in the database timetable (RECOGNITION_ROOM); a room without
+    # timetable rows, or None, follows PERIOD_SCHEDULE on every day
+    room = os.environ.get("RECOGNITION_ROOM") or None
 
     # Capture photos through webcam
     max_iterations = 5  # Define the maximum number of iterations
     iteration_count = 0  # Initialize the iteration count
 
     while iteration_count < max_iterations:
-        current_time = datetime.now().strftime("%H:%M")
+        timetable = load_timetable(PERIOD_SCHEDULE)
+        now = datetime.now()
 
         # Check if it's within any of the scheduled periods
-        current_period = None
-        for i, period in enumerate(period_schedule):
-            start_time = period["start_time"]
-            end_time = period["end_time"]
-
-            if start_time <= current_time <= end_time:
-                current_period = i + 1  # Periods are 1-indexed
-                break
+        class_session = timetable.session_at(room, now)
+        next_transition = timetable.next_transition(room, now)
 
-        if current_period:
+        if class_session:
+            current_period = class_session.period
             print(f"Current period: {current_period}")
 
             cap = cv2.VideoCapture(0)  # 0 corresponds to the default webcam
 
-            # Toggle camera on
-            ret, frame = cap.read()
-
-            if ret:
-                recognized_faces = recognize_faces(known_faces_students + known_faces_teachers,
-                                                    known_face_names_students + known_face_names_teachers,
-                                                    frame)
-
-                print("Recognized Faces:", recognized_faces)  # Debugging print statement
-
-                # If a teacher is recognized, set the subject automatically and start the iteration loop
-                for teacher_name in recognized_faces.intersection(known_face_names_teachers):
-                    teacher_data = teacher_subject_map.get(teacher_name)
-                    if teacher_data:
-                        subject = teacher_data["subject"]
-                        database_path = teacher_data["database"]
-
-                        print("Teacher {} detected. Subject set to: {}".format(teacher_name, subject))  # Debugging print statement
-
-                        # Insert classes taken by the teacher
-                        insert_classes_taken(database_path, teacher_name, subject)
-
-                        # Recognize students and insert attendance
-                        recorded_students = set()  # Set to keep track of recorded students in the current iteration
-
-                        while True:
-                            # Capture photo
-                            ret, frame = cap.read()
-
-                            if ret:
-                                recognized_faces = recognize_faces(known_faces_students, known_face_names_students, frame)
-
-                                # Insert attendance for recognized students
-                                for name in recognized_faces:
-                                    if name in known_face_names_students and name not in recorded_students:
-                                        try:
-                                            # Record attendance with the current timestamp and period
-                                            insert_attendance(database_path, name)
-                                            print("Attendance recorded for student:", name)  # Debugging print statement
-                                            recorded_students.add(name)  # Add the student to recorded students
-                                        except Exception as e:
-                                            print("Error inserting attendance for student:", name, "Error:", e)
-                                    elif name in known_face_names_students:
-                                        # Only print the recognized face if it's not a duplicate
-                                        print("Attendance already recorded for student:", name)
-                                    else:
-                                        print("Unrecognized face:", name)  # Debugging print statement
-
-                            else:
-                                print("Failed to capture a frame from the webcam.")
-
-                            if cv2.waitKey(1) & 0xFF == ord('q'):
-                                break
-
-                        print("Exiting the iteration loop.")
-
-                    # Release the webcam
-                    cap.release()
-
-                    iteration_count += 1  # Increment the iteration count
-
-                else:
-                    print("Failed to capture a frame from the webcam.")
+            # The session waits for a teacher to set the subject, then records recognized students.
+            # Subjects come from the registry the admin assigns them in, so changes apply from the next period.
+            session = AttendanceSession(known_face_names_teachers, known_face_names_students,
+                                        get_teacher_subject_map(), current_period, writer=attendance_writer,
+                                        expected_subject=class_session.subject, presence=presence_cache)
+            pipeline = FramePipeline(cap, matcher, session.handle, detect_workers=detect_workers,
+                                     encode_workers=encode_workers, queue_size=frame_queue_size,
+                                     detection_config=detection_config,
+                                     tracker=FaceTracker(reencode_interval=reencode_interval))
+            pipeline.start()
+
+            try:
+                # Capture until the period ends
+                while pipeline.running and datetime.now() < next_transition:
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+                    time.sleep(0.1)
+            except KeyboardInterrupt:
+                pass
+
+            pipeline.stop()
+            print("Exiting the iteration loop.")
+            print("Frames captured: {}, processed: {}, skipped (no motion): {}, dropped: {}".format(
+                pipeline.frames_captured, pipeline.frames_processed, pipeline.frames_skipped,
+                pipeline.dropped_frames))
+            print("Faces detected: {}, encoded: {}".format(pipeline.faces_detected, pipeline.faces_encoded))
+
+            # Release the webcam and write out any pending attendance
+            cap.release()
+            attendance_writer.flush()
+
+            iteration_count += 1  # Increment the iteration count
+        elif next_transition is None:
+            print("Nothing is scheduled in the timetable.")
+            break
         else:
-            print("No scheduled period at the current time.")
+            print(f"No scheduled period at the current time. Next period at {next_transition:%a %H:%M}.")
 
-        # Add a delay before checking the schedule again
-        # Adjust the duration based on your specific needs
-        cv2.waitKey(5000)  # Delay for 5 seconds
+            # Sleep until the next period starts, re-reading the timetable at least every minute
+            time.sleep(max(0, min((next_transition - now).total_seconds(), 60)))
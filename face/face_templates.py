@@ -0,0 +1,111 @@
+import cv2
+import numpy as np
+import face_recognition
+from search_index import ENCODING_SIZE
+
+# Face height in pixels from which a bigger face stops adding quality
+TARGET_FACE_SIZE = 120
+# Variance of the Laplacian of a sharp face crop; blurrier crops score proportionally lower
+SHARP_VARIANCE = 100.0
+# Samples scoring below this are not used as templates, unless an identity has nothing better
+MIN_QUALITY = 0.15
+# Templates kept per identity, and whether they are the best samples ("top_k") or one
+# quality-weighted average of them ("centroid")
+TEMPLATES_PER_IDENTITY = 3
+TEMPLATE_MODE = "top_k"
+
+
+# Function to score how big a face is, from 0 to 1
+def size_score(face_location):
+    top, right, bottom, left = face_location
+    return min(1.0, (bottom - top) / TARGET_FACE_SIZE)
+
+
+# Function to score how sharp a face is, from 0 to 1, by the variance of the Laplacian of its crop
+def blur_score(image, face_location):
+    top, right, bottom, left = face_location
+    crop = image[max(0, top):bottom, max(0, left):right]
+    if crop.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY) if crop.ndim == 3 else crop
+    return min(1.0, cv2.Laplacian(gray, cv2.CV_64F).var() / SHARP_VARIANCE)
+
+
+# Function to score how frontal a face is, from 0 to 1.
+# A turned head moves the nose tip away from the middle of the eyes, and a tilted one
+# puts the eyes at different heights. Faces without landmarks are not penalised.
+def pose_score(landmarks):
+    if not landmarks or not all(key in landmarks for key in ("left_eye", "right_eye", "nose_tip")):
+        return 1.0
+    left_eye = np.mean(landmarks["left_eye"], axis=0)
+    right_eye = np.mean(landmarks["right_eye"], axis=0)
+    nose_tip = np.mean(landmarks["nose_tip"], axis=0)
+    eye_distance = np.linalg.norm(right_eye - left_eye)
+    if eye_distance == 0:
+        return 0.0
+    yaw = abs(nose_tip[0] - (left_eye[0] + right_eye[0]) / 2) / eye_distance
+    roll = abs(right_eye[1] - left_eye[1]) / eye_distance
+    return float(max(0.0, 1 - 2 * yaw) * max(0.0, 1 - roll))
+
+
+# Function to score a face sample from 0 (unusable) to 1 (large, sharp and frontal)
+def score_face(image, face_location, landmarks=None):
+    return size_score(face_location) * blur_score(image, face_location) * pose_score(landmarks)
+
+
+# Function to encode the best face in an image file.
+# Photos sometimes catch somebody in the background; only the face with the highest quality
+# (which is nearly always the largest) belongs to the person the file is named after.
+# Returns the encodings (none or one) and the quality of the face.
+def encode_best_face(image_path):
+    image = face_recognition.load_image_file(image_path)
+    face_locations = face_recognition.face_locations(image)
+    if not face_locations:
+        return [], 0.0
+
+    landmarks = face_recognition.face_landmarks(image, face_locations)
+    scores = [score_face(image, face_location, face_landmarks)
+              for face_location, face_landmarks in zip(face_locations, landmarks)]
+    best = int(np.argmax(scores))
+    face_encodings = face_recognition.face_encodings(image, [face_locations[best]], model="large")
+    return face_encodings, scores[best]
+
+
+# Function to reduce one identity's samples to its templates.
+# Samples below min_quality are dropped unless none are better; of the rest the best k are kept,
+# or averaged into one centroid weighted by quality.
+def select_templates(encodings, qualities, k=TEMPLATES_PER_IDENTITY, mode=TEMPLATE_MODE, min_quality=MIN_QUALITY):
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+    qualities = np.asarray(qualities, dtype=np.float32)
+    if not len(encodings):
+        return encodings
+
+    order = np.argsort(-qualities, kind="stable")
+    good = order[qualities[order] >= min_quality]
+    chosen = good[:k] if len(good) else order[:1]
+
+    if mode == "centroid":
+        weights = np.maximum(qualities[chosen], 1e-3)
+        return (np.average(encodings[chosen], axis=0, weights=weights)[None, :]).astype(np.float32)
+    return encodings[chosen]
+
+
+# Function to build the templates of every identity in an embedding store.
+# entries are the store's per-image entries (see embedding_store.py); returns the template
+# matrix and one name per row.
+def build_templates(matrix, entries, **options):
+    samples = {}
+    for entry in entries:
+        rows = matrix[entry["start"]:entry["start"] + entry["count"]]
+        encodings, qualities = samples.setdefault(entry["name"], ([], []))
+        encodings.extend(rows)
+        qualities.extend([entry.get("quality", 1.0)] * len(rows))
+
+    blocks, names = [], []
+    for name, (encodings, qualities) in samples.items():
+        templates = select_templates(encodings, qualities, **options)
+        blocks.append(templates)
+        names.extend([name] * len(templates))
+
+    matrix = np.concatenate(blocks) if blocks else np.empty((0, ENCODING_SIZE), dtype=np.float32)
+    return matrix, names
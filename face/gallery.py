@@ -0,0 +1,122 @@
+import threading
+import numpy as np
+from embedding_store import sync_templates, ENCODING_SIZE
+from matcher import FaceMatcher, MATCH_MIN_MARGIN
+from attdatabase import get_db, close_db
+
+KINDS = ("student", "teacher")
+
+
+# Known faces of the students and teachers, kept in step with the image folders and the database
+# while the recognizer runs. Each person is matched against their best few samples (see face_templates.py).
+# A watcher thread re-syncs the embedding stores every refresh interval: only new or changed
+# photos are encoded, in worker processes, and the resulting deltas are applied to the live
+# matcher, which keeps matching frames meanwhile. Only students and teachers registered in the
+# database are loaded: people deleted from it are left out even when their photo stays behind,
+# and come back if they are registered again. student_names and teacher_names are sets updated in place.
+class Gallery:
+    def __init__(self, student_dir, teacher_dir, search_backend="exact", tolerance=0.5, min_margin=MATCH_MIN_MARGIN,
+                 workers=None):
+        self.dirs = {"student": student_dir, "teacher": teacher_dir}
+        self.workers = workers or 1  # Photos are always encoded in worker processes
+        self.student_names = set()
+        self.teacher_names = set()
+        self._entries = {kind: {} for kind in KINDS}  # kind -> image path -> applied store entry
+        self._sync_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.matcher = FaceMatcher(np.empty((0, ENCODING_SIZE), dtype=np.float32), [],
+                                   tolerance=tolerance, min_margin=min_margin, backend=search_backend)
+        self.sync()
+
+    def _names(self, kind):
+        return self.student_names if kind == "student" else self.teacher_names
+
+    # Function to add a person's encodings, replacing any they already had
+    def add(self, name, known_faces, kind="student"):
+        known_faces = np.asarray(known_faces, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        self.matcher.update(name, known_faces)
+        self._names(kind).add(name)
+
+    # Function to remove everything known about a person's face
+    def remove(self, name):
+        self.matcher.remove([name])
+        self.student_names.discard(name)
+        self.teacher_names.discard(name)
+
+    # Function to bring the matcher up to date with the image folders and the database.
+    # Only photos of people registered in the database are used, so people deleted before or
+    # while the recognizer runs are not recognized, and come back once they are registered again.
+    # Returns the names that were added or updated and the names that were removed.
+    def sync(self):
+        with self._sync_lock:
+            registered = self._registered_names()
+
+            added, removed = [], []
+            for kind in KINDS:
+                templates, template_names, entries = sync_templates(self.dirs[kind], workers=self.workers)
+                previous = self._entries[kind]
+                current = {entry["path"]: entry for entry in entries if entry["name"] in registered}
+                rows_by_name = {}
+                for row, name in enumerate(template_names):
+                    if name in registered:
+                        rows_by_name.setdefault(name, []).append(row)
+
+                # A person whose photos changed, or who was registered or deleted, gets their
+                # templates replaced, or is removed
+                changed = {entry["name"] for path, entry in previous.items()
+                           if path not in current or current[path]["size"] != entry["size"]
+                           or current[path]["mtime"] != entry["mtime"]}
+                changed |= {entry["name"] for path, entry in current.items() if path not in previous}
+
+                for name in changed:
+                    rows = rows_by_name.get(name)
+                    if not rows:
+                        removed.append((name, kind))
+                        continue
+                    added.append((name, kind, templates[rows]))
+
+                self._entries[kind] = current
+
+            added_names = {name for name, kind, rows in added}
+            removed_names = {name for name, kind in removed} - added_names
+            if added or removed_names:
+                blocks = [rows for name, kind, rows in added]
+                self.matcher.replace(removed_names | added_names,
+                                     np.concatenate(blocks) if blocks else np.empty((0, ENCODING_SIZE), dtype=np.float32),
+                                     [name for name, kind, rows in added for _ in range(len(rows))])
+            for name, kind in removed:
+                if name not in added_names:
+                    self._names(kind).discard(name)
+            for name, kind, rows in added:
+                self._names(kind).add(name)
+
+            if added or removed_names:
+                print(f"Gallery updated: {len(added)} added or changed, {len(removed_names)} removed")
+            return sorted(added_names), sorted(removed_names)
+
+    def _registered_names(self):
+        db = get_db()
+        rows = db.execute("SELECT username FROM students UNION SELECT username FROM teachers").fetchall()
+        close_db(db)
+        return {row[0] for row in rows}
+
+    # Function to keep syncing in the background every refresh_interval seconds
+    def start(self, refresh_interval=5.0):
+        self._thread = threading.Thread(target=self._watch, args=(refresh_interval,), name="gallery-watcher",
+                                        daemon=True)
+        self._thread.start()
+
+    def _watch(self, refresh_interval):
+        while not self._stopped.wait(refresh_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                print("Error updating the gallery:", e)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,170 @@
+import threading
+import numpy as np
+from search_index import ENCODING_SIZE, create_index
+
+UNKNOWN = "Unknown"
+# How much closer a face must be to its best identity than to anybody else to be accepted
+MATCH_MIN_MARGIN = 0.05
+
+
+# Result of matching one detected face against the gallery
+class Match:
+    __slots__ = ("name", "distance", "margin")
+
+    def __init__(self, name, distance, margin):
+        self.name = name
+        self.distance = distance
+        self.margin = margin
+
+    @property
+    def is_known(self):
+        return self.name != UNKNOWN
+
+    def __repr__(self):
+        return f"Match({self.name!r}, distance={self.distance:.3f}, margin={self.margin:.3f})"
+
+
+# Matcher resolving detected faces against the known encodings.
+# The nearest-neighbour search is delegated to a pluggable backend from search_index:
+# "exact" compares every probe of a frame with the whole gallery in one matrix product,
+# "ivf" only scans the closest clusters so large galleries stay fast.
+# Each probe resolves to its best identity, the distance to it and the margin to the
+# closest different identity among the candidates returned by the backend. A face is only
+# accepted when it is within tolerance and at least min_margin closer to its identity than to
+# anybody else, so a face that looks like two people marks neither.
+# Identities can be added and removed while frames are being matched. Removed rows are only
+# marked dead and skipped by the search; once they make up a large part of the gallery the
+# backend is rebuilt from the live rows without holding up matching.
+class FaceMatcher:
+    def __init__(self, known_faces, known_face_names, tolerance=0.5, backend="exact", candidates=16,
+                 min_margin=MATCH_MIN_MARGIN, **index_options):
+        known_faces = np.asarray(known_faces, dtype=np.float32).reshape(len(known_face_names), ENCODING_SIZE)
+
+        self.tolerance = tolerance
+        self.candidates = candidates
+        self.min_margin = min_margin
+        self.backend = backend
+        self.index_options = index_options
+        self.names = []
+        self.identities = []
+        self._identity_ids = {}
+        self.labels = np.empty(0, dtype=np.int32)
+        self.dead = np.empty(0, dtype=bool)
+        self.dead_count = 0
+        self._version = 0  # Bumped on every change, so a rebuild can tell whether it is still current
+        self._lock = threading.RLock()
+
+        self.index = create_index(backend, **index_options)
+        self.add(known_faces, known_face_names)
+
+    def __len__(self):
+        return len(self.names) - self.dead_count
+
+    # Function to add encodings to the gallery; the search backend is updated incrementally
+    def add(self, known_faces, known_face_names):
+        known_faces = np.asarray(known_faces, dtype=np.float32).reshape(len(known_face_names), ENCODING_SIZE)
+        with self._lock:
+            # Every row is labelled with an identity id so the margin skips other samples of the same person
+            for name in known_face_names:
+                if name not in self._identity_ids:
+                    self._identity_ids[name] = len(self.identities)
+                    self.identities.append(name)
+            labels = np.array([self._identity_ids[name] for name in known_face_names], dtype=np.int32)
+            self.labels = np.concatenate([self.labels, labels])
+            self.dead = np.concatenate([self.dead, np.zeros(len(labels), dtype=bool)])
+            self.names.extend(known_face_names)
+            self.index.add(known_faces)
+            self._version += 1
+
+    # Function to remove every encoding of the given identities, returning how many rows went
+    def remove(self, names):
+        with self._lock:
+            removed = self._mark_dead(names)
+        self._compact_if_needed()
+        return removed
+
+    # Function to replace all encodings of one identity
+    def update(self, name, known_faces):
+        self.replace([name], known_faces, [name] * len(known_faces))
+
+    # Function to remove some identities and add encodings in one step, so matching never sees
+    # an identity that is being updated missing
+    def replace(self, removed_names, known_faces, known_face_names):
+        with self._lock:
+            self._mark_dead(removed_names)
+            self.add(known_faces, known_face_names)
+        self._compact_if_needed()
+
+    def _mark_dead(self, names):
+        ids = [self._identity_ids[name] for name in names if name in self._identity_ids]
+        rows = np.isin(self.labels, ids) & ~self.dead
+        removed = int(rows.sum())
+        if removed:
+            self.dead = self.dead | rows
+            self.dead_count += removed
+            self._version += 1
+        return removed
+
+    def _compact_if_needed(self):
+        if self.dead_count > max(self.candidates, len(self.names) // 4):
+            self.compact()
+
+    # Function to rebuild the search backend from the live rows only.
+    # The new index is built outside the lock and dropped if the gallery changed in the meantime.
+    def compact(self):
+        with self._lock:
+            version = self._version
+            live = ~self.dead
+            encodings = self.index.buffer.data[live].copy()
+            names = [name for name, alive in zip(self.names, live) if alive]
+            labels = self.labels[live]
+
+        index = create_index(self.backend, **self.index_options)
+        index.add(encodings)
+
+        with self._lock:
+            if self._version != version:
+                return False
+            self.index = index
+            self.names = names
+            self.labels = labels
+            self.dead = np.zeros(len(names), dtype=bool)
+            self.dead_count = 0
+            self._version += 1
+            return True
+
+    # Function to match every face of a frame, returning one Match per face
+    def match(self, face_encodings):
+        if len(face_encodings) == 0:
+            return []
+
+        probes = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        with self._lock:
+            if len(self) == 0:
+                return [Match(UNKNOWN, float("inf"), 0.0) for _ in face_encodings]
+            # Asking for as many extra candidates as there are dead rows keeps enough live ones
+            distances, rows = self.index.search(probes, self.candidates + self.dead_count)
+            labels = self.labels
+            dead = self.dead
+            names = self.names
+
+        matches = []
+        for row_distances, row_ids in zip(distances, rows):
+            alive = row_ids >= 0
+            alive[alive] = ~dead[row_ids[alive]]
+            row_distances, row_ids = row_distances[alive], row_ids[alive]
+            if not len(row_ids):
+                matches.append(Match(UNKNOWN, float("inf"), 0.0))
+                continue
+
+            best_distance = float(row_distances[0])
+            best_label = labels[row_ids[0]]
+
+            # Closest candidate that belongs to somebody else
+            others = labels[row_ids] != best_label
+            second_distance = float(row_distances[others][0]) if others.any() else float("inf")
+
+            margin = second_distance - best_distance
+            known = best_distance <= self.tolerance and margin >= self.min_margin
+            matches.append(Match(names[row_ids[0]] if known else UNKNOWN, best_distance, margin))
+        return matches
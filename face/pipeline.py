@@ -0,0 +1,443 @@
+import os
+import sys
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import face_recognition
+from detection import AdaptiveDetector, scale_down, locate_faces, scale_up
+from tracker import FaceTracker
+
+# metrics.py lives in the project root, one level above this directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+
+# Per-frame timings reported by the pipeline: capture is reading a frame, motion the motion check,
+# detect face_locations, encode face_encodings, match the gallery search, record the attendance
+# session, and frame the whole way from capture to record
+STAGES = ("capture", "motion", "detect", "encode", "match", "record", "frame")
+stage_seconds = metrics.histogram("recognizer_stage_seconds", "Time spent in each recognition stage per frame",
+                                  ("camera", "stage"))
+frames_total = metrics.counter("recognizer_frames_total", "Frames by outcome", ("camera", "outcome"))
+faces_total = metrics.counter("recognizer_faces_total", "Faces detected and faces sent to the encoder",
+                              ("camera", "kind"))
+
+
+# Function to encode faces from their crops; only the crops travel to the worker, not the frame.
+# Runs in the encoding worker pool; returns the encodings and the time spent in milliseconds.
+def encode_faces(crops):
+    start = time.perf_counter()
+    face_encodings = []
+    for crop, face_location in crops:
+        face_encodings.extend(face_recognition.face_encodings(crop, [face_location], model="large"))
+    return face_encodings, (time.perf_counter() - start) * 1000
+
+
+# Function to cut each face out of the frame with some padding, so the landmark model sees the whole face.
+# Each crop comes with the face location relative to the crop.
+def crop_faces(frame, face_locations, padding=0.25):
+    height, width = frame.shape[:2]
+    crops = []
+    for top, right, bottom, left in face_locations:
+        pad_y = int((bottom - top) * padding)
+        pad_x = int((right - left) * padding)
+        crop_top, crop_left = max(0, top - pad_y), max(0, left - pad_x)
+        crop_bottom, crop_right = min(height, bottom + pad_y), min(width, right + pad_x)
+        crop = frame[crop_top:crop_bottom, crop_left:crop_right].copy()
+        crops.append((crop, (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)))
+    return crops
+
+
+# Bounded queue that never blocks the producer: when it is full the oldest item is dropped.
+# Stale frames are worth less than fresh ones, so capture always keeps up with the camera.
+class DropOldestQueue:
+    def __init__(self, maxsize):
+        self._queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def get_nowait(self):
+        return self._queue.get_nowait()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+# Process pool shared by several pipelines (one per camera) with round-robin scheduling.
+# Each pipeline submits through its own client; whenever a worker is free the next client in
+# turn that has work waiting gets it, so a camera with many faces cannot starve the others.
+# Pipelines still bound their own jobs in flight, which is each camera's worker budget.
+class FairExecutor:
+    def __init__(self, workers):
+        self.workers = workers
+        self._pool = ProcessPoolExecutor(workers)
+        self._waiting = {}  # client name -> deque of (future, function, args)
+        self._turns = deque()  # client names in round-robin order
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    # Function to get the submit interface for one pipeline
+    def client(self, name):
+        with self._lock:
+            if name not in self._waiting:
+                self._waiting[name] = deque()
+                self._turns.append(name)
+        return FairExecutorClient(self, name)
+
+    def _submit(self, name, function, args):
+        future = Future()
+        with self._lock:
+            self._waiting[name].append((future, function, args))
+        self._dispatch()
+        return future
+
+    def _dispatch(self):
+        # Jobs are picked under the lock but handed to the pool outside it, since the pool may
+        # call back into _dispatch straight away
+        jobs = []
+        with self._lock:
+            while self._in_flight < self.workers:
+                for _ in range(len(self._turns)):
+                    name = self._turns[0]
+                    self._turns.rotate(-1)
+                    if self._waiting[name]:
+                        jobs.append(self._waiting[name].popleft())
+                        self._in_flight += 1
+                        break
+                else:
+                    break
+
+        for future, function, args in jobs:
+            if not future.set_running_or_notify_cancel():
+                self._job_done()
+                continue
+            try:
+                self._pool.submit(function, *args).add_done_callback(
+                    lambda pool_future, future=future: self._finish(pool_future, future))
+            except RuntimeError as e:  # The pool has been shut down
+                future.set_exception(e)
+                self._job_done()
+
+    def _finish(self, pool_future, future):
+        if pool_future.cancelled():
+            future.cancel()
+        elif pool_future.exception() is not None:
+            future.set_exception(pool_future.exception())
+        else:
+            future.set_result(pool_future.result())
+        self._job_done()
+
+    def _job_done(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._dispatch()
+
+    # Function to drop the jobs a client still has waiting
+    def cancel(self, name):
+        with self._lock:
+            waiting, self._waiting[name] = self._waiting[name], deque()
+        for future, function, args in waiting:
+            future.cancel()
+
+    def shutdown(self):
+        for name in list(self._waiting):
+            self.cancel(name)
+        self._pool.shutdown(cancel_futures=True)
+
+
+# One pipeline's handle on a FairExecutor, with the submit/shutdown interface of a process pool
+class FairExecutorClient:
+    def __init__(self, executor, name):
+        self.executor = executor
+        self.name = name
+
+    def submit(self, function, *args):
+        return self.executor._submit(self.name, function, args)
+
+    # Shutting a client down only drops its waiting jobs; the shared pool keeps running
+    def shutdown(self, cancel_futures=True):
+        self.executor.cancel(self.name)
+
+
+# Capture -> detect -> encode -> match -> record pipeline.
+# Capture, matching and recording run on threads of this process; detection and encoding run in
+# process pools so every core is busy. Frames flow through drop-oldest queues, and each pool
+# stage only has as many frames in flight as it has workers, so a slow stage sheds old frames
+# instead of building up latency. on_recognized is called with the set of names seen in each frame.
+# Detection goes through an AdaptiveDetector configured per camera, and timing stats for every
+# frame are kept in self.stats (and passed to on_stats when given).
+# Detected faces are followed by a FaceTracker, so only faces without a confident identity (or
+# due for their periodic re-check) are sent to the encoders.
+# With detect_executor/encode_executor (FairExecutors shared by several cameras) the pipeline uses
+# them instead of starting its own pools, and detect_workers/encode_workers become its budget there.
+class FramePipeline:
+    def __init__(self, capture, matcher, on_recognized, detect_workers=None, encode_workers=None,
+                 queue_size=4, detection_config=None, tracker=None, on_stats=None, stats_size=500,
+                 detect_executor=None, encode_executor=None, name="webcam"):
+        cpu_count = os.cpu_count() or 1
+        self.detect_workers = detect_workers or max(1, cpu_count // 2)
+        self.encode_workers = encode_workers or max(1, cpu_count - self.detect_workers)
+
+        self.name = name
+        self.detect_executor = detect_executor
+        self.encode_executor = encode_executor
+        self.capture = capture
+        self.matcher = matcher
+        self.on_recognized = on_recognized
+        self.on_stats = on_stats
+        self.detector = AdaptiveDetector(detection_config)
+        self.tracker = tracker or FaceTracker()
+        self.stats = deque(maxlen=stats_size)
+
+        self.frames = DropOldestQueue(queue_size)
+        self.detected = DropOldestQueue(queue_size)
+        self.encoded = DropOldestQueue(queue_size)
+        # Recognitions carry attendance, so this queue blocks rather than drops
+        self.recognized = queue.Queue(queue_size)
+
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self.frames_failed = 0
+        self.capture_failures = 0
+        self.faces_detected = 0
+        self.faces_encoded = 0
+
+        self._stopped = threading.Event()
+        self._threads = []
+        self._detect_pool = None
+        self._encode_pool = None
+        self._detect_slots = threading.Semaphore(self.detect_workers)
+        self._encode_slots = threading.Semaphore(self.encode_workers)
+
+    @property
+    def running(self):
+        return not self._stopped.is_set()
+
+    @property
+    def dropped_frames(self):
+        return self.frames.dropped + self.detected.dropped + self.encoded.dropped
+
+    def start(self):
+        if self.detect_executor:
+            self._detect_pool = self.detect_executor.client(f"{self.name}-detect")
+        else:
+            self._detect_pool = ProcessPoolExecutor(self.detect_workers)
+        if self.encode_executor:
+            self._encode_pool = self.encode_executor.client(f"{self.name}-encode")
+        else:
+            self._encode_pool = ProcessPoolExecutor(self.encode_workers)
+        stages = [
+            ("capture", self._capture_loop),
+            ("detect", lambda: self._stage_loop(self.frames, self._detect)),
+            ("encode", lambda: self._stage_loop(self.detected, self._encode)),
+            ("match", lambda: self._stage_loop(self.encoded, self._match)),
+            ("record", lambda: self._stage_loop(self.recognized, self._record)),
+        ]
+        for name, target in stages:
+            thread = threading.Thread(target=target, name=f"{self.name}-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for pool in (self._detect_pool, self._encode_pool):
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def _capture_loop(self):
+        frame_index = 0
+        while not self._stopped.is_set():
+            start = time.perf_counter()
+            ret, frame = self.capture.read()
+            stage_seconds.observe(time.perf_counter() - start, self.name, "capture")
+            if not ret:
+                # Captures that can run out (uploaded files) say so; the frames read stay in the pipeline
+                if getattr(self.capture, "finished", False):
+                    return
+                self.capture_failures += 1
+                print(f"Failed to capture a frame from {self.name}.")
+                self._stopped.wait(0.1)
+                continue
+            self.frames_captured += 1
+            self.frames.put((frame_index, frame, {"frame": frame_index, "captured_at": time.perf_counter()}))
+            frame_index += 1
+
+    def _stage_loop(self, inbox, handle):
+        while not self._stopped.is_set():
+            try:
+                item = inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                handle(item)
+            except Exception as e:
+                print("Error in recognition pipeline:", e)
+                self._fail(item[-1])
+
+    # Function to push one frame through every stage on the calling thread, without the process pools.
+    # Used for reproducible offline runs (see replay.py); returns the frame's stats.
+    def process_frame(self, frame_index, frame):
+        stats = {"frame": frame_index, "captured_at": time.perf_counter()}
+        self.frames_captured += 1
+        self._detect((frame_index, frame, stats))
+        for inbox, handle in ((self.detected, self._encode), (self.encoded, self._match),
+                              (self.recognized, self._record)):
+            try:
+                handle(inbox.get_nowait())
+            except queue.Empty:
+                break
+        return stats
+
+    # Function to run a job in a pool once a worker slot is free, passing its result to on_done.
+    # A job that raises fails the frame whose stats are given. Without pools (process_frame) the job runs inline.
+    def _submit(self, pool, slots, stats, on_done, function, *args):
+        if pool is None:
+            on_done(function(*args))
+            return
+
+        while not slots.acquire(timeout=0.1):
+            if self._stopped.is_set():
+                return
+
+        def done(future):
+            slots.release()
+            if future.cancelled():
+                return
+            try:
+                result = future.result()
+            except Exception as e:
+                print("Error in recognition worker:", e)
+                self._fail(stats)
+                return
+            try:
+                on_done(result)
+            except Exception as e:
+                print("Error in recognition pipeline:", e)
+                self._fail(stats)
+
+        pool.submit(function, *args).add_done_callback(done)
+
+    # Function to close the stats of a frame that a stage or worker failed on, so it still counts as gone
+    def _fail(self, stats):
+        self.frames_failed += 1
+        stats["failed"] = True
+        stats.pop("captured_at", None)
+        self.stats.append(stats)
+        frames_total.inc(self.name, "failed")
+
+    # Function to close a frame's stats once the frame leaves the pipeline
+    def _finish(self, stats, skipped=False):
+        if skipped:
+            self.frames_skipped += 1
+        else:
+            self.frames_processed += 1
+        stats["skipped"] = skipped
+        stats["latency_ms"] = (time.perf_counter() - stats.pop("captured_at")) * 1000
+        self.stats.append(stats)
+
+        frames_total.inc(self.name, "skipped" if skipped else "processed")
+        for stage in STAGES[1:-1]:
+            if f"{stage}_ms" in stats:
+                stage_seconds.observe(stats[f"{stage}_ms"] / 1000, self.name, stage)
+        stage_seconds.observe(stats["latency_ms"] / 1000, self.name, "frame")
+        faces_total.inc(self.name, "detected", amount=stats.get("faces", 0))
+        faces_total.inc(self.name, "encoded", amount=stats.get("encoded_faces", 0))
+        if self.on_stats:
+            self.on_stats(stats)
+
+    def _detect(self, item):
+        frame_index, frame, stats = item
+
+        # Skip frames where nothing in the room moved
+        start = time.perf_counter()
+        has_motion, stats["motion_delta"] = self.detector.has_motion(frame)
+        stats["motion_ms"] = (time.perf_counter() - start) * 1000
+        if not has_motion:
+            self._finish(stats, skipped=True)
+            return
+
+        stats["upsample"] = self.detector.upsample
+
+        # Only the downscaled copy goes to the detection worker; the boxes are scaled back here
+        detect_scale = self.detector.config.detect_scale
+        start = time.perf_counter()
+        small_frame = scale_down(frame, detect_scale)
+        resize_ms = (time.perf_counter() - start) * 1000
+
+        def detected(result):
+            small_locations, locate_ms = result
+            face_locations = scale_up(small_locations, detect_scale, frame.shape)
+            stats["detect_ms"] = resize_ms + locate_ms
+            stats["faces"] = len(face_locations)
+            self.detector.observe(face_locations)
+            self.detected.put((frame_index, frame, face_locations, stats))
+
+        self._submit(self._detect_pool, self._detect_slots, stats, detected,
+                     locate_faces, small_frame, self.detector.upsample)
+
+    def _encode(self, item):
+        frame_index, frame, face_locations, stats = item
+        if not face_locations:
+            self._finish(stats)
+            return
+
+        # Faces whose track already has a confident identity, or is still being encoded, skip the encoder
+        tracks = self.tracker.update(face_locations, frame_index)
+        pending = [i for i, track in enumerate(tracks) if self.tracker.needs_encoding(track, frame_index)]
+        self.faces_detected += len(tracks)
+        self.faces_encoded += len(pending)
+        stats["encoded_faces"] = len(pending)
+        if not pending:
+            self.encoded.put((frame_index, tracks, [], [], stats))
+            return
+
+        def encoded(result):
+            face_encodings, stats["encode_ms"] = result
+            self.encoded.put((frame_index, tracks, [tracks[i] for i in pending], face_encodings, stats))
+
+        self._submit(self._encode_pool, self._encode_slots, stats, encoded,
+                     encode_faces, crop_faces(frame, [face_locations[i] for i in pending]))
+
+    def _match(self, item):
+        frame_index, tracks, encoded_tracks, face_encodings, stats = item
+        start = time.perf_counter()
+        for track, match in zip(encoded_tracks, self.matcher.match(face_encodings)):
+            self.tracker.assign(track, match, frame_index)
+        recognized_faces = {track.name for track in tracks if track.name is not None}
+        stats["match_ms"] = (time.perf_counter() - start) * 1000
+
+        if not recognized_faces:
+            self._finish(stats)
+            return
+        while not self._stopped.is_set():
+            try:
+                self.recognized.put((frame_index, recognized_faces, stats), timeout=0.1)
+                break
+            except queue.Full:
+                continue
+
+    def _record(self, item):
+        frame_index, recognized_faces, stats = item
+        start = time.perf_counter()
+        self.on_recognized(recognized_faces)
+        stats["record_ms"] = (time.perf_counter() - start) * 1000
+        self._finish(stats)
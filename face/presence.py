@@ -0,0 +1,85 @@
+import time
+import threading
+from collections import OrderedDict
+from attdatabase import get_db, close_db
+import database
+
+
+# Students already marked present, per (subject, date, period), shared by every session in the process.
+# The attendance event log in the database is the source of truth: a session's students are read
+# from it the first time the session is asked about, and after that only events with a higher id
+# than the last one seen are read, at most once per refresh_interval. Marks written by other processes
+# or before a restart are picked up the same way, so students who are already present are
+# skipped before they reach the attendance writer.
+class PresenceCache:
+    def __init__(self, refresh_interval=1.0, max_sessions=64):
+        self.refresh_interval = refresh_interval
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # (subject, date, period) -> set of student ids
+        self._database = None
+        self._last_event_id = None
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    # Function to return the students marked present in a session; the set must not be modified
+    def marked(self, subject, date, period):
+        key = (subject, date, period)
+        with self._lock:
+            if self._database != database.DATABASE:
+                self._reset()
+            if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+                self._refresh()
+            if key not in self._sessions:
+                self._load(key)
+            self._sessions.move_to_end(key)
+            return self._sessions[key]
+
+    # Function to mark a student present as soon as their attendance is queued, before it is written
+    def add(self, subject, date, period, student_id):
+        with self._lock:
+            students = self._sessions.get((subject, date, period))
+            if students is not None:
+                students.add(student_id)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._sessions.clear()
+        self._database = database.DATABASE
+        self._last_event_id = None
+        self._refreshed_at = 0.0
+
+    def _load(self, key):
+        db = get_db()
+        rows = db.execute('''SELECT student_id FROM attendance_events
+                             WHERE subject = ? AND date = ? AND period = ?''', key).fetchall()
+        close_db(db)
+        self._sessions[key] = {row[0] for row in rows}
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    # Function to add events written since the last refresh to the sessions held in memory
+    def _refresh(self):
+        db = get_db()
+        if self._last_event_id is None:
+            # Everything already in the log is read when a session is first loaded
+            row = db.execute("SELECT MAX(id) FROM attendance_events").fetchone()
+            self._last_event_id = row[0] or 0
+            rows = []
+        else:
+            rows = db.execute('''SELECT id, student_id, subject, date, period FROM attendance_events
+                                 WHERE id > ? ORDER BY id''', (self._last_event_id,)).fetchall()
+        close_db(db)
+
+        for event_id, student_id, subject, date, period in rows:
+            students = self._sessions.get((subject, date, period))
+            if students is not None:
+                students.add(student_id)
+            self._last_event_id = event_id
+        self._refreshed_at = time.monotonic()
+
+
+# One cache per process, shared by every camera and session
+presence_cache = PresenceCache()
@@ -0,0 +1,261 @@
+import os
+import csv
+import json
+import time
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta
+import cv2
+import numpy as np
+from face import load_gallery, PERIOD_SCHEDULE
+from detection import DetectionConfig
+from pipeline import FramePipeline
+from tracker import FaceTracker
+from session import AttendanceSession
+from presence import PresenceCache
+from timetable import Timetable, load_timetable
+import database
+from attdatabase import init_db, get_teacher_subject_map, AttendanceWriter
+
+STAGES = ["decode", "detect", "encode", "match", "record", "flush"]
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+# Function to read frames from a video file or a directory of images, timing the decode of each one
+def read_frames(source):
+    if os.path.isdir(source):
+        paths = sorted(os.path.join(source, name) for name in os.listdir(source)
+                       if name.lower().endswith(IMAGE_EXTENSIONS))
+        for path in paths:
+            start = time.perf_counter()
+            frame = cv2.imread(path)
+            decode_ms = (time.perf_counter() - start) * 1000
+            if frame is not None:
+                yield frame, decode_ms
+        return
+
+    cap = cv2.VideoCapture(source)
+    try:
+        while True:
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            decode_ms = (time.perf_counter() - start) * 1000
+            if not ret:
+                break
+            yield frame, decode_ms
+    finally:
+        cap.release()
+
+
+# Function to load a ground-truth CSV with "frame,name" rows into {frame index: set of names}
+def load_ground_truth(path):
+    ground_truth = defaultdict(set)
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            ground_truth[int(row["frame"])].add(row["name"])
+    return ground_truth
+
+
+# Function to compare recognized names with the ground truth, per frame and for the final attendance.
+# recognized has an entry for every frame inside a scheduled period; frames outside one are not
+# scored, since the session rightly records nothing then.
+def score_accuracy(recognized, ground_truth, recorded_students, student_names):
+    true_positives = false_positives = false_negatives = 0
+    expected_students = set()
+    for frame_index, found in recognized.items():
+        expected = ground_truth.get(frame_index, set())
+        true_positives += len(found & expected)
+        false_positives += len(found - expected)
+        false_negatives += len(expected - found)
+        expected_students |= expected
+    expected_students &= set(student_names)
+    return {
+        "frame_precision": true_positives / max(1, true_positives + false_positives),
+        "frame_recall": true_positives / max(1, true_positives + false_negatives),
+        "attendance_expected": sorted(expected_students),
+        "attendance_recorded": sorted(recorded_students),
+        "attendance_missed": sorted(expected_students - recorded_students),
+        "attendance_wrong": sorted(recorded_students - expected_students),
+    }
+
+
+# Function to summarise stage latencies as percentiles in milliseconds
+def latency_percentiles(latencies):
+    summary = {}
+    for stage in STAGES:
+        values = latencies.get(stage)
+        if values:
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            summary[stage] = {"count": len(values), "p50": p50, "p90": p90, "p99": p99, "max": max(values)}
+    return summary
+
+
+# Function to list the students present in a replayed session: those it recorded, and those the
+# presence cache skipped because the replay database already had them for the period
+def session_students(session, presence):
+    if session.subject is None:
+        return set(session.recorded_students)
+    date = session.clock().date().isoformat()
+    return session.recorded_students | (presence.marked(session.subject, date, session.period) & session.student_names)
+
+
+# Function to flush the attendance writer, returning the time it took in milliseconds
+def timed_flush(writer):
+    start = time.perf_counter()
+    writer.flush()
+    return (time.perf_counter() - start) * 1000
+
+
+# Function to replay a recording through the full recognition and attendance path.
+# Time comes from a simulated clock that starts at start_time and advances 1/fps per frame,
+# so runs are reproducible and go as fast as the machine allows. The attendance writer is
+# flushed on the simulated clock too, every flush_interval simulated seconds.
+# Sessions follow the room's timetable and are set up with the same subject check and
+# presence cache as the live capture loop.
+def replay(source, start_time, fps, matcher, student_names, teacher_names, teacher_subject_map,
+           detection_config=None, reencode_interval=50, ground_truth=None, flush_interval=1.0,
+           timetable=None, room=None):
+    timetable = timetable or Timetable.from_periods(PERIOD_SCHEDULE)
+    writer = AttendanceWriter(background=False)
+    presence = PresenceCache()
+    next_flush = start_time + timedelta(seconds=flush_interval)
+    latencies = defaultdict(list)
+    recognized = {}
+    recorded_students = set()
+    current = {"class_session": None, "session": None, "pipeline": None, "recognized": set(), "now": start_time}
+
+    def on_recognized(recognized_faces):
+        current["recognized"] = recognized_faces
+        current["session"].handle(recognized_faces)
+
+    frames = frames_in_session = 0
+    started = time.perf_counter()
+    for frame_index, (frame, decode_ms) in enumerate(read_frames(source)):
+        frames += 1
+        now = start_time + timedelta(seconds=frame_index / fps)
+        class_session = timetable.session_at(room, now)
+        if class_session is None:
+            continue
+
+        # A new timetable session starts a new attendance session, exactly like the live capture loop
+        if class_session != current["class_session"]:
+            if current["session"]:
+                recorded_students |= session_students(current["session"], presence)
+            current["class_session"] = class_session
+            current["session"] = AttendanceSession(teacher_names, student_names, teacher_subject_map,
+                                                   class_session.period, writer=writer, clock=lambda: current["now"],
+                                                   expected_subject=class_session.subject, presence=presence)
+            current["pipeline"] = FramePipeline(None, matcher, on_recognized, detection_config=detection_config,
+                                                tracker=FaceTracker(reencode_interval=reencode_interval))
+
+        frames_in_session += 1
+        current["now"] = now
+        current["recognized"] = set()
+        stats = current["pipeline"].process_frame(frame_index, frame)
+        recognized[frame_index] = current["recognized"]
+
+        latencies["decode"].append(decode_ms)
+        for stage in STAGES[1:-1]:
+            if f"{stage}_ms" in stats:
+                latencies[stage].append(stats[f"{stage}_ms"])
+
+        if now >= next_flush:
+            latencies["flush"].append(timed_flush(writer))
+            next_flush = now + timedelta(seconds=flush_interval)
+
+    latencies["flush"].append(timed_flush(writer))
+    writer.close()
+    elapsed = time.perf_counter() - started
+
+    if current["session"]:
+        recorded_students |= session_students(current["session"], presence)
+
+    report = {
+        "frames": frames,
+        "frames_in_session": frames_in_session,
+        "seconds": elapsed,
+        "frames_per_second": frames / elapsed if elapsed else 0.0,
+        "latency_ms": latency_percentiles(latencies),
+    }
+    if ground_truth is not None:
+        report["accuracy"] = score_accuracy(recognized, ground_truth, recorded_students, student_names)
+    return report
+
+
+# Function to register the gallery people and the teachers' subjects in the replay database,
+# since attendance is only kept for registered students
+def seed_roster(student_names, teacher_names, teacher_subject_map):
+    db = database.get_db()
+    with db:
+        db.executemany("INSERT OR IGNORE INTO students (name, username, semester, department) VALUES (?, ?, '', '')",
+                       [(name, name) for name in set(student_names)])
+        db.executemany("INSERT OR IGNORE INTO teachers (name, username) VALUES (?, ?)",
+                       [(name, name) for name in set(teacher_names) | set(teacher_subject_map)])
+        db.execute("DELETE FROM subjects")
+        db.executemany("INSERT INTO subjects (name, teacher_username) VALUES (?, ?)",
+                       [(subject, teacher) for teacher, teacher_data in teacher_subject_map.items()
+                        for subject in teacher_data["subjects"]])
+    database.close_db(db)
+
+
+def print_report(report):
+    print(f"Frames: {report['frames']} ({report['frames_in_session']} in a scheduled period) "
+          f"in {report['seconds']:.2f}s = {report['frames_per_second']:.2f} frames/sec")
+    print(f"{'stage':<8}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, summary in report["latency_ms"].items():
+        print(f"{stage:<8}{summary['count']:>8}{summary['p50']:>10.2f}{summary['p90']:>10.2f}"
+              f"{summary['p99']:>10.2f}{summary['max']:>10.2f}")
+    if "accuracy" in report:
+        accuracy = report["accuracy"]
+        print(f"Frame precision: {accuracy['frame_precision']:.3f}, recall: {accuracy['frame_recall']:.3f}")
+        print("Attendance missed:", accuracy["attendance_missed"])
+        print("Attendance wrongly recorded:", accuracy["attendance_wrong"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a video or a folder of frames through face recognition")
+    parser.add_argument("source", help="video file or directory of frame images")
+    parser.add_argument("--start", default="09:30", help='simulated start time, "HH:MM" or "YYYY-MM-DD HH:MM"')
+    parser.add_argument("--room", help="timetable room the recording was made in; rooms without "
+                                       "timetable rows follow the default period schedule")
+    parser.add_argument("--fps", type=float, default=10.0, help="simulated frames per second of the recording")
+    parser.add_argument("--ground-truth", help='CSV file with "frame,name" rows')
+    parser.add_argument("--database", default="replay_attendance.db",
+                        help="database file the replay writes attendance to")
+    parser.add_argument("--search-backend", default="exact", choices=["exact", "ivf"])
+    parser.add_argument("--detect-scale", type=float, default=0.5)
+    parser.add_argument("--motion-threshold", type=float, default=2.0)
+    parser.add_argument("--reencode-interval", type=int, default=50)
+    parser.add_argument("--report", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    start_time = datetime.strptime(args.start, "%Y-%m-%d %H:%M") if " " in args.start \
+        else datetime.combine(datetime.now().date(), datetime.strptime(args.start, "%H:%M").time())
+
+    # Keep replayed attendance out of the real database, but use the real teachers' subjects and timetable
+    if os.path.exists(database.DATABASE):
+        teacher_subject_map = get_teacher_subject_map()
+        timetable = load_timetable(PERIOD_SCHEDULE)
+    else:
+        teacher_subject_map = {}
+        timetable = Timetable.from_periods(PERIOD_SCHEDULE)
+    database.DATABASE = args.database
+    init_db()
+
+    matcher, student_names, teacher_names = load_gallery(args.search_backend)
+    seed_roster(student_names, teacher_names, teacher_subject_map)
+    ground_truth = load_ground_truth(args.ground_truth) if args.ground_truth else None
+    detection_config = DetectionConfig(detect_scale=args.detect_scale, motion_threshold=args.motion_threshold)
+
+    report = replay(args.source, start_time, args.fps, matcher, student_names, teacher_names, teacher_subject_map,
+                    detection_config=detection_config, reencode_interval=args.reencode_interval,
+                    ground_truth=ground_truth, timetable=timetable, room=args.room)
+    print_report(report)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import numpy as np
+
+ENCODING_SIZE = 128
+
+
+# Growable float32 matrix of encodings with their squared norms.
+# Capacity doubles when full so repeated adds do not copy the whole gallery each time.
+class EncodingBuffer:
+    def __init__(self, encodings=None):
+        encodings = np.empty((0, ENCODING_SIZE), dtype=np.float32) if encodings is None else encodings
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        self.size = 0
+        self._data = np.empty((max(len(encodings), 16), ENCODING_SIZE), dtype=np.float32)
+        self._norms = np.empty(len(self._data), dtype=np.float32)
+        self.append(encodings)
+
+    @property
+    def data(self):
+        return self._data[:self.size]
+
+    @property
+    def norms(self):
+        return self._norms[:self.size]
+
+    # Function to append rows, returning the row ids they were given
+    def append(self, encodings):
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        needed = self.size + len(encodings)
+        if needed > len(self._data):
+            capacity = max(needed, 2 * len(self._data))
+            data = np.empty((capacity, ENCODING_SIZE), dtype=np.float32)
+            data[:self.size] = self.data
+            norms = np.empty(capacity, dtype=np.float32)
+            norms[:self.size] = self.norms
+            self._data, self._norms = data, norms
+
+        self._data[self.size:needed] = encodings
+        self._norms[self.size:needed] = np.einsum('ij,ij->i', encodings, encodings)
+        row_ids = np.arange(self.size, needed)
+        self.size = needed
+        return row_ids
+
+
+# Function to compute euclidean distances between probes and a set of rows in one matrix product
+def pairwise_distances(probes, encodings, norms):
+    squared = probes @ encodings.T
+    squared *= -2
+    squared += norms
+    squared += np.einsum('ij,ij->i', probes, probes)[:, None]
+    np.maximum(squared, 0, out=squared)
+    return np.sqrt(squared, out=squared)
+
+
+# Function to pick the k smallest distances of every row, sorted nearest first
+def top_k(distances, k, row_ids=None):
+    k = min(k, distances.shape[1])
+    if k == 0:
+        empty = np.empty((len(distances), 0))
+        return empty, empty.astype(np.int64)
+
+    if k == 1:
+        nearest = distances.argmin(axis=1)[:, None]
+        nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+        return nearest_distances, (row_ids[nearest] if row_ids is not None else nearest)
+
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k] if k < distances.shape[1] \
+        else np.tile(np.arange(distances.shape[1]), (len(distances), 1))
+    nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+    order = np.argsort(nearest_distances, axis=1)
+    nearest = np.take_along_axis(nearest, order, axis=1)
+    nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+
+    if row_ids is not None:
+        nearest = row_ids[nearest]
+    return nearest_distances, nearest
+
+
+# Exact search: every probe is compared with every known encoding
+class ExactIndex:
+    def __init__(self, encodings=None):
+        self.buffer = EncodingBuffer(encodings)
+
+    def __len__(self):
+        return self.buffer.size
+
+    def add(self, encodings):
+        return self.buffer.append(encodings)
+
+    def search(self, probes, k):
+        distances = pairwise_distances(probes, self.buffer.data, self.buffer.norms)
+        return top_k(distances, k)
+
+
+# Approximate search with IVF-style coarse clustering.
+# Encodings are grouped around k-means centroids and a probe only scans the rows of its
+# nprobe closest clusters; raising nprobe trades speed for recall.
+# Every cluster keeps its own contiguous copy of its rows, so a frame is searched with one
+# matrix product per touched cluster instead of gathering rows per probe.
+# New rows are assigned to the existing clusters, and the clustering is retrained once the
+# gallery has doubled since it was last trained.
+class IVFIndex:
+    def __init__(self, encodings=None, nlist=None, nprobe=8, train_iterations=10, seed=0):
+        self.buffer = EncodingBuffer()
+        self.requested_nlist = nlist
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.random = np.random.default_rng(seed)
+        self.centroids = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self.lists = []
+        self.trained_size = 0
+
+        if encodings is not None:
+            self.add(encodings)
+
+    def __len__(self):
+        return self.buffer.size
+
+    def add(self, encodings):
+        row_ids = self.buffer.append(encodings)
+        if self.buffer.size > 2 * self.trained_size or not len(self.centroids):
+            self.train()
+        elif len(row_ids):
+            self._assign(row_ids)
+        return row_ids
+
+    # Function to (re)build the clusters from the current gallery
+    def train(self):
+        data = self.buffer.data
+        if not len(data):
+            return
+
+        nlist = self.requested_nlist or max(1, int(np.sqrt(len(data))))
+        nlist = min(nlist, len(data))
+
+        # Train on a sample; a few hundred points per cluster are plenty for the centroids
+        sample = data
+        if len(data) > 256 * nlist:
+            sample = data[self.random.choice(len(data), 256 * nlist, replace=False)]
+
+        centroids = sample[self.random.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.train_iterations):
+            assignment = self._nearest_centroids(sample, centroids, 1)[:, 0]
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        self.centroids = centroids
+        self.lists = [(np.empty(0, dtype=np.int64), np.empty((0, ENCODING_SIZE), dtype=np.float32),
+                       np.empty(0, dtype=np.float32)) for _ in range(nlist)]
+        self.trained_size = len(data)
+        self._assign(np.arange(len(data)))
+
+    def _nearest_centroids(self, vectors, centroids, count):
+        distances = pairwise_distances(vectors, centroids, np.einsum('ij,ij->i', centroids, centroids))
+        return top_k(distances, count)[1]
+
+    def _assign(self, row_ids):
+        assignment = self._nearest_centroids(self.buffer.data[row_ids], self.centroids, 1)[:, 0]
+        for cluster in np.unique(assignment):
+            rows = row_ids[assignment == cluster]
+            ids, data, norms = self.lists[cluster]
+            self.lists[cluster] = (np.concatenate([ids, rows]),
+                                   np.concatenate([data, self.buffer.data[rows]]),
+                                   np.concatenate([norms, self.buffer.norms[rows]]))
+
+    def search(self, probes, k):
+        if not self.buffer.size:
+            return np.full((len(probes), k), np.inf), np.full((len(probes), k), -1, dtype=np.int64)
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        clusters = self._nearest_centroids(probes, self.centroids, nprobe)
+
+        # Every probe gets k candidate slots per scanned cluster
+        candidate_distances = np.full((len(probes), nprobe * k), np.inf)
+        candidate_rows = np.full((len(probes), nprobe * k), -1, dtype=np.int64)
+
+        # Visit each touched cluster once and score all the probes that scan it together
+        flat_clusters = clusters.ravel()
+        order = np.argsort(flat_clusters, kind='stable')
+        groups = np.split(order, np.flatnonzero(np.diff(flat_clusters[order])) + 1)
+        for group in groups:
+            ids, data, norms = self.lists[flat_clusters[group[0]]]
+            if not len(ids):
+                continue
+            probe_ids, slots = np.divmod(group, nprobe)
+            found_distances, found_rows = top_k(pairwise_distances(probes[probe_ids], data, norms), k, ids)
+            columns = slots[:, None] * k + np.arange(found_rows.shape[1])
+            candidate_distances[probe_ids[:, None], columns] = found_distances
+            candidate_rows[probe_ids[:, None], columns] = found_rows
+
+        distances, positions = top_k(candidate_distances, k)
+        return distances, np.take_along_axis(candidate_rows, positions, axis=1)
+
+
+SEARCH_BACKENDS = {
+    "exact": ExactIndex,
+    "ivf": IVFIndex,
+}
+
+
+# Function to create a search backend by name
+def create_index(backend, encodings=None, **options):
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError(f"Unknown search backend: {backend}")
+    return SEARCH_BACKENDS[backend](encodings, **options)
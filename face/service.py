@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+import cv2
+from face import KNOWN_FACES_DIR_STUDENTS, KNOWN_FACES_DIR_TEACHERS, PERIOD_SCHEDULE, MATCH_MIN_MARGIN
+from detection import DetectionConfig
+from pipeline import FairExecutor, FramePipeline
+from tracker import FaceTracker
+from gallery import Gallery
+from session import AttendanceSession
+from presence import presence_cache
+from attdatabase import init_db, get_teacher_subject_map, AttendanceWriter
+from timetable import Timetable, load_timetable
+import metrics
+
+# Longest a camera sleeps before re-reading the timetable, so edits to it are picked up
+SCHEDULE_RECHECK_INTERVAL = 60.0
+
+
+# Video source that reopens itself when reading fails, e.g. after an RTSP stream drops or at
+# the end of a video file, so a camera recovers without restarting the service
+class ReconnectingCapture:
+    def __init__(self, source, reconnect_delay=2.0):
+        # Digit strings are device indices, anything else a URL or file path
+        self.source = int(source) if isinstance(source, str) and source.isdigit() else source
+        self.reconnect_delay = reconnect_delay
+        self.reconnects = 0
+        self._capture = cv2.VideoCapture(self.source)
+
+    def read(self):
+        ret, frame = self._capture.read()
+        if ret:
+            return ret, frame
+
+        # Runs on the pipeline's capture thread, so waiting here only holds up this camera
+        self._capture.release()
+        time.sleep(self.reconnect_delay)
+        self.reconnects += 1
+        self._capture = cv2.VideoCapture(self.source)
+        return False, None
+
+    def release(self):
+        self._capture.release()
+
+
+# One classroom camera: its own source, room and worker budget.
+# A thread follows the room's timetable, starting a pipeline and an attendance session when
+# a period begins and stopping them when it ends. Between transitions the thread sleeps until
+# the next one, so cameras do no work outside scheduled sessions.
+class Camera:
+    def __init__(self, service, config):
+        self.service = service
+        self.name = config["name"]
+        self.room = config.get("room", self.name)
+        self.source = config["source"]
+        # A timetable in the camera's config overrides the one in the database, but not its holidays
+        self.periods = config.get("timetable")
+        self.timetable = None
+        self._database_timetable = None
+        self.detect_workers = config.get("detect_workers", 1)
+        self.encode_workers = config.get("encode_workers", 1)
+        self.detection_config = DetectionConfig(**config.get("detection", {}))
+        self.reencode_interval = config.get("reencode_interval", 50)
+
+        self.period = None
+        self.class_session = None
+        self.pipeline = None
+        self.session = None
+        self._capture = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"camera-{self.name}", daemon=True)
+        self._thread.start()
+
+    def join(self):
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        stopped = self.service.stopped
+        while not stopped.is_set():
+            timetable = self._timetable()
+            now = datetime.now()
+            class_session = timetable.session_at(self.room, now)
+            if class_session != self.class_session:
+                self._end_period()
+                if class_session is not None:
+                    self._start_period(class_session)
+
+            next_transition = timetable.next_transition(self.room, now)
+            wait = SCHEDULE_RECHECK_INTERVAL
+            if next_transition is not None:
+                wait = min(wait, (next_transition - now).total_seconds())
+            stopped.wait(max(wait, 0))
+        self._end_period()
+
+    # Function to get the timetable the camera follows. A camera with its own periods is rebuilt
+    # whenever the database timetable is reloaded, so it skips the same holidays.
+    def _timetable(self):
+        timetable = load_timetable(PERIOD_SCHEDULE)
+        if self.periods is None:
+            return timetable
+        if timetable is not self._database_timetable:
+            self._database_timetable = timetable
+            self.timetable = Timetable.from_periods(self.periods, timetable.holidays)
+        return self.timetable
+
+    def _start_period(self, class_session):
+        period = class_session.period
+        print(f"{self.room}: period {period} started" + (f" ({class_session.subject})" if class_session.subject else ""))
+        self.period = period
+        self.class_session = class_session
+        self._capture = ReconnectingCapture(self.source)
+        self.session = AttendanceSession(self.service.teacher_names, self.service.student_names,
+                                         get_teacher_subject_map(), period, writer=self.service.writer,
+                                         expected_subject=class_session.subject, presence=presence_cache)
+        self.pipeline = FramePipeline(self._capture, self.service.matcher, self.session.handle,
+                                      detect_workers=self.detect_workers, encode_workers=self.encode_workers,
+                                      detection_config=self.detection_config,
+                                      tracker=FaceTracker(reencode_interval=self.reencode_interval),
+                                      detect_executor=self.service.detect_executor,
+                                      encode_executor=self.service.encode_executor, name=self.name)
+        self.pipeline.start()
+
+    def _end_period(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self._capture.release()
+            print(f"{self.room}: period {self.period} ended, {self.status()}")
+        self.period = None
+        self.class_session = None
+        self.pipeline = None
+        self.session = None
+        self._capture = None
+
+    # Function to summarise what the camera is doing
+    def status(self):
+        pipeline = self.pipeline
+        if pipeline is None:
+            return {"camera": self.name, "room": self.room, "period": None}
+        return {
+            "camera": self.name,
+            "room": self.room,
+            "period": self.period,
+            "subject": self.session.subject if self.session else None,
+            "frames_captured": pipeline.frames_captured,
+            "frames_processed": pipeline.frames_processed,
+            "frames_skipped": pipeline.frames_skipped,
+            "frames_dropped": pipeline.dropped_frames,
+            "faces_encoded": pipeline.faces_encoded,
+            "reconnects": self._capture.reconnects if self._capture else 0,
+        }
+
+
+# Long-running recognition service for many classrooms on one node.
+# The gallery is loaded once and shared by every camera, and detection and encoding run on two
+# process pools shared by all cameras with fair round-robin scheduling; each camera gets at most
+# its own worker budget in flight. Attendance from every room goes through one batched writer.
+class RecognitionService:
+    def __init__(self, config, matcher, student_names, teacher_names):
+        cpu_count = os.cpu_count() or 1
+        detect_workers = config.get("detect_workers") or max(1, cpu_count // 2)
+        encode_workers = config.get("encode_workers") or max(1, cpu_count - detect_workers)
+
+        self.matcher = matcher
+        self.student_names = student_names
+        self.teacher_names = teacher_names
+        self.stopped = threading.Event()
+        self.writer = AttendanceWriter(flush_interval=config.get("flush_interval", 1.0))
+        self.detect_executor = FairExecutor(detect_workers)
+        self.encode_executor = FairExecutor(encode_workers)
+        self.cameras = [Camera(self, camera_config) for camera_config in config["cameras"]]
+
+        names = [camera.name for camera in self.cameras]
+        if len(set(names)) != len(names):
+            raise ValueError("Camera names must be unique")
+
+    def start(self):
+        for camera in self.cameras:
+            camera.start()
+
+    def stop(self):
+        self.stopped.set()
+        for camera in self.cameras:
+            camera.join()
+        self.detect_executor.shutdown()
+        self.encode_executor.shutdown()
+        self.writer.close()
+
+    def status(self):
+        return [camera.status() for camera in self.cameras]
+
+
+# Function to read the service configuration, for example the following; cameras without a
+# "timetable" follow their room in the database timetable (see timetable.py):
+# {"search_backend": "exact", "detect_workers": 4, "encode_workers": 4,
+#  "cameras": [{"name": "room101", "source": "rtsp://10.0.0.5/stream", "room": "Room 101",
+#               "encode_workers": 2, "detection": {"detect_scale": 0.5},
+#               "timetable": [{"start_time": "09:20", "end_time": "10:20"}]}]}
+def load_config(path):
+    with open(path) as f:
+        config = json.load(f)
+    if not config.get("cameras"):
+        raise ValueError(f"No cameras configured in {path}")
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run face recognition attendance for several classroom cameras")
+    parser.add_argument("config", help="JSON file describing the cameras")
+    parser.add_argument("--status-interval", type=float, default=60.0, help="seconds between status reports")
+    parser.add_argument("--metrics-port", type=int, help="serve /metrics and /profile?seconds=N on this port")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    init_db()
+    # New or changed photos and deleted students are applied to the running gallery; photos are
+    # encoded by gallery_workers processes so the cameras keep most of the machine
+    gallery = Gallery(KNOWN_FACES_DIR_STUDENTS, KNOWN_FACES_DIR_TEACHERS, config.get("search_backend", "exact"),
+                      config.get("tolerance", 0.5), config.get("min_margin", MATCH_MIN_MARGIN),
+                      workers=config.get("gallery_workers", 1))
+    gallery.start(config.get("gallery_refresh_interval", 5.0))
+
+    service = RecognitionService(config, gallery.matcher, gallery.student_names, gallery.teacher_names)
+    service.start()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    print(f"Serving {len(service.cameras)} cameras with a gallery of {len(gallery.matcher)} faces")
+    try:
+        while not service.stopped.wait(args.status_interval):
+            for status in service.status():
+                print(status)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gallery.stop()
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+from datetime import datetime
+from attdatabase import insert_classes_taken, insert_attendance
+
+
+# Attendance for one class session.
+# The session waits until a teacher is recognized, which sets the subject and counts the class
+# (once per period, see insert_classes_taken), and from then on records attendance for each recognized student once.
+# Marks are attendance events for (student, subject, date, period); the database rejects repeats,
+# so restarting a session within a period never counts a student twice.
+# With an AttendanceWriter the marks are batched; without one each mark is written immediately.
+# When the timetable says which subject is taught, only a teacher of that subject starts the class.
+# With a PresenceCache, students already marked for the period by any session, process or earlier
+# run are skipped without being written again.
+class AttendanceSession:
+    def __init__(self, teacher_names, student_names, teacher_subject_map, period, writer=None, clock=datetime.now,
+                 expected_subject=None, presence=None):
+        # Sets are kept as they are, so people a live Gallery adds during the session count straight away
+        self.teacher_names = teacher_names if isinstance(teacher_names, set) else set(teacher_names)
+        self.student_names = student_names if isinstance(student_names, set) else set(student_names)
+        self.teacher_subject_map = teacher_subject_map
+        self.period = period
+        self.writer = writer
+        self.clock = clock
+        self.expected_subject = expected_subject
+        self.presence = presence
+
+        self.teacher_name = None
+        self.subject = None
+        self.recorded_students = set()  # Students already sent for recording, to avoid re-sending every frame
+
+    # Function to handle the set of faces recognized in one frame
+    def handle(self, recognized_faces):
+        print("Recognized Faces:", recognized_faces)  # Debugging print statement
+
+        if self.subject is None:
+            self._start_class(recognized_faces)
+        else:
+            self._record_students(recognized_faces)
+
+    def _start_class(self, recognized_faces):
+        # If a teacher is recognized, set the subject automatically
+        for teacher_name in recognized_faces & self.teacher_names:
+            teacher_data = self.teacher_subject_map.get(teacher_name)
+            if not teacher_data:
+                continue
+            if self.expected_subject is not None and self.expected_subject not in teacher_data["subjects"]:
+                print("Teacher {} does not teach {}".format(teacher_name, self.expected_subject))  # Debugging print statement
+                continue
+            self.start_class(teacher_name)
+            break
+
+    # Function to start the class for a teacher, whether recognized on camera or logged in on the web app
+    def start_class(self, teacher_name):
+        self.teacher_name = teacher_name
+        self.subject = self.expected_subject or self.teacher_subject_map[teacher_name]["subject"]
+
+        print("Teacher {} started the class. Subject set to: {}".format(teacher_name, self.subject))  # Debugging print statement
+
+        # Count the class for the teacher, once per period however often it is started
+        insert_classes_taken(teacher_name, self.subject, self.clock().date().isoformat(), self.period)
+
+    def _record_students(self, recognized_faces):
+        now = self.clock()
+        date = now.date().isoformat()
+        recorded_at = now.isoformat(timespec="seconds")
+        marked = self.presence.marked(self.subject, date, self.period) if self.presence else ()
+
+        # Insert attendance for recognized students
+        for name in recognized_faces:
+            if name in self.student_names and name not in self.recorded_students and name not in marked:
+                try:
+                    # Record attendance with the current timestamp and period
+                    if self.writer:
+                        self.writer.record(name, self.subject, date, self.period, recorded_at)
+                    else:
+                        insert_attendance(name, self.subject, date, self.period, recorded_at)
+                    print("Attendance recorded for student:", name)  # Debugging print statement
+                    self.recorded_students.add(name)  # Add the student to recorded students
+                    if self.presence:
+                        self.presence.add(self.subject, date, self.period, name)
+                except Exception as e:
+                    print("Error inserting attendance for student:", name, "Error:", e)
+            elif name in self.student_names:
+                # Only print the recognized face if it's not a duplicate
+                print("Attendance already recorded for student:", name)
+            elif name not in self.teacher_names:
+                print("Unrecognized face:", name)  # Debugging print statement
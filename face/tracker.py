@@ -0,0 +1,122 @@
+import threading
+import numpy as np
+
+
+# A face followed across frames. Once matched, the track keeps its identity so the face
+# does not have to be encoded again on every frame.
+class Track:
+    def __init__(self, track_id, face_location, frame_index):
+        self.id = track_id
+        self.location = face_location
+        self.name = None
+        self.distance = float("inf")
+        self.last_seen = frame_index
+        self.last_encoded = None
+        self.pending = None  # Frame whose encoding of this track is still being encoded or matched
+        self.missed = 0
+
+    def __repr__(self):
+        return f"Track({self.id}, name={self.name!r}, distance={self.distance:.3f})"
+
+
+# Function to compute the intersection-over-union of every pair of boxes in (top, right, bottom, left) form
+def box_iou(boxes_a, boxes_b):
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top = np.maximum(a[:, None, 0], b[None, :, 0])
+    right = np.minimum(a[:, None, 1], b[None, :, 1])
+    bottom = np.minimum(a[:, None, 2], b[None, :, 2])
+    left = np.maximum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(bottom - top, 0, None) * np.clip(right - left, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 1] - a[:, 3])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 1] - b[:, 3])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-6), 0)
+
+
+# Lightweight IoU tracker.
+# Detections are greedily associated with the existing track they overlap most. A track is
+# re-encoded only when it has no identity yet, when its last match was not confident
+# (distance above confident_distance), or every reencode_interval frames as a safety check.
+# Tracks that go unmatched for max_missed updates are dropped.
+# A track sent for encoding is pending until its result is assigned, and is not sent again
+# meanwhile unless the result is pending_timeout frames late. Results can come back out of order
+# from several workers; one for an older frame than the track's last result is dropped.
+class FaceTracker:
+    def __init__(self, iou_threshold=0.3, max_missed=10, reencode_interval=50, confident_distance=0.45,
+                 pending_timeout=25):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.reencode_interval = reencode_interval
+        self.confident_distance = confident_distance
+        self.pending_timeout = pending_timeout
+
+        self.tracks = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    # Function to associate the faces of a frame with tracks; returns the track of each face
+    def update(self, face_locations, frame_index):
+        with self._lock:
+            assigned = [None] * len(face_locations)
+            matched_tracks = set()
+
+            if self.tracks and face_locations:
+                overlaps = box_iou([track.location for track in self.tracks], face_locations)
+                # Greedy association, best overlap first
+                for flat in np.argsort(overlaps, axis=None)[::-1]:
+                    track_index, face_index = np.unravel_index(flat, overlaps.shape)
+                    if overlaps[track_index, face_index] < self.iou_threshold:
+                        break
+                    if track_index in matched_tracks or assigned[face_index] is not None:
+                        continue
+                    matched_tracks.add(track_index)
+                    assigned[face_index] = self.tracks[track_index]
+
+            for i, track in enumerate(self.tracks):
+                if i not in matched_tracks:
+                    track.missed += 1
+            self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+
+            for face_index, face_location in enumerate(face_locations):
+                track = assigned[face_index]
+                if track is None:
+                    track = Track(self._next_id, face_location, frame_index)
+                    self._next_id += 1
+                    self.tracks.append(track)
+                track.location = face_location
+                track.last_seen = max(track.last_seen, frame_index)
+                track.missed = 0
+                assigned[face_index] = track
+
+            return assigned
+
+    # Function to decide whether a track has to be encoded on this frame.
+    # A track that has to be is marked pending for this frame, since the caller submits it.
+    def needs_encoding(self, track, frame_index):
+        with self._lock:
+            if track.pending is not None and frame_index - track.pending < self.pending_timeout:
+                return False
+            needed = track.name is None \
+                or track.distance > self.confident_distance \
+                or frame_index - track.last_encoded >= self.reencode_interval
+            if needed:
+                track.pending = frame_index
+            return needed
+
+    # Function to store the result of matching a track's encoding.
+    # Returns False when the result is older than the track's last one and was dropped.
+    def assign(self, track, match, frame_index):
+        with self._lock:
+            if track.pending is not None and frame_index >= track.pending:
+                track.pending = None
+            if track.last_encoded is not None and frame_index < track.last_encoded:
+                return False
+            track.last_encoded = frame_index
+            if match.is_known:
+                track.name = match.name
+                track.distance = match.distance
+            else:
+                track.name = None
+                track.distance = float("inf")
+            return True
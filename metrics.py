@@ -0,0 +1,342 @@
+import os
+import sys
+import hmac
+import time
+import threading
+import functools
+from bisect import bisect_left
+from collections import Counter as StackCounter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Set ATTENDANCE_METRICS=0 to turn metrics off. Timers are then replaced by the plain function
+# when it is decorated, and every other call returns straight away.
+ENABLED = os.environ.get("ATTENDANCE_METRICS", "1") != "0"
+
+# Latency buckets in seconds, from a cached query up to a slow page or face encoding
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Scrapers without the admin login send this as "Authorization: Bearer <token>". Unset, only the
+# admin can read the web app's metrics, and the standalone metrics server is open to anyone.
+TOKEN = os.environ.get("ATTENDANCE_METRICS_TOKEN") or None
+
+# Longest profile one request can ask for
+MAX_PROFILE_SECONDS = 60.0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+# Monotonic count per combination of label values
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in values]
+
+
+# Latency histogram with fixed buckets per combination of label values
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [count per bucket (last is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        if not ENABLED:
+            return
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            value = self._values.get(label_values)
+            if value is None:
+                value = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            value[0][i] += 1
+            value[1] += seconds
+
+    def count(self, *label_values):
+        value = self._values.get(label_values)
+        return sum(value[0]) if value else 0
+
+    # Function to time a block and record it under the given labels
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels + ('le',), key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+# Every metric of the process, in the order they were created
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    # Function to write every metric in the Prometheus text format
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+counter = registry.counter
+histogram = registry.histogram
+render = registry.render
+
+
+# Function to make a decorator that times each call of a function in a histogram labelled with
+# the function's name. With metrics turned off the function is returned as it is.
+def timer(name, help, label):
+    calls = histogram(name, help, (label,))
+
+    def decorator(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                calls.observe(time.perf_counter() - start, function.__name__)
+        return wrapper
+    return decorator
+
+
+# Function to count and time every Flask request by endpoint
+def init_app(app):
+    if not ENABLED:
+        return
+    from flask import g, request
+
+    requests = counter("http_requests_total", "HTTP requests handled", ("endpoint", "method", "status"))
+    latency = histogram("http_request_seconds", "Time to handle an HTTP request", ("endpoint",))
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "unknown"
+            latency.observe(time.perf_counter() - start, endpoint)
+            requests.inc(endpoint, request.method, response.status_code)
+        return response
+
+
+# Sampling profiler for finding hot paths in a running process.
+# A background thread looks at the stack of every other thread every interval seconds and counts
+# each distinct stack. Nothing runs until it is started, so it costs nothing while off.
+class SamplingProfiler:
+    def __init__(self, interval=0.005, max_depth=40):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = StackCounter()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()  # Guards starting and stopping, and the counts
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            thread.join()
+
+    def clear(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stopped.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks.append(";".join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    # Function to return the most sampled stacks in the folded format flame graph tools read,
+    # one "thread;outer;...;inner count" line per stack
+    def dump(self, limit=50):
+        # Formatted from a copy, as the sampler may still be counting
+        with self._lock:
+            stacks = self._stacks.copy()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common(limit))
+
+
+profiler = SamplingProfiler()
+_profile_lock = threading.Lock()
+
+
+# Function to profile the process for a number of seconds and return the folded stacks.
+# Only one request runs the profiler at a time; requests made meanwhile get the stacks sampled so far.
+def profile(seconds=5.0, limit=50):
+    if not _profile_lock.acquire(blocking=False):
+        return profiler.dump(limit)
+    try:
+        profiler.clear()
+        profiler.start()
+        time.sleep(seconds)
+        profiler.stop()
+        return profiler.dump(limit)
+    finally:
+        _profile_lock.release()
+
+
+# Function to check an Authorization header against the metrics token
+def token_matches(authorization):
+    if not TOKEN or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode(), f"Bearer {TOKEN}".encode())
+
+
+# Function to read how long to profile for, capped at MAX_PROFILE_SECONDS.
+# Returns None when the value is not a positive number.
+def profile_seconds(value, default=5.0):
+    if value is None:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        return None
+    if not seconds > 0:  # Also rejects NaN
+        return None
+    return min(seconds, MAX_PROFILE_SECONDS)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if TOKEN and not token_matches(self.headers.get("Authorization")):
+            self.send_error(401)
+            return
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            body = render()
+        elif url.path == "/profile":
+            seconds = profile_seconds(parse_qs(url.query).get("seconds", [None])[0])
+            if seconds is None:
+                self.send_error(400, "seconds must be a positive number")
+                return
+            body = profile(seconds)
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to serve /metrics and /profile?seconds=N over HTTP from a background thread,
+# for processes without a web app of their own such as the recognition service
+def serve(port, host="0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,157 @@
+import os
+import glob
+import sqlite3
+import argparse
+import database
+from database import get_db, close_db, init_db, update_attendance_percentages
+
+# Legacy global databases, each holding one table with the same name as in the new schema
+LEGACY_TABLES = [
+    ("teachers.db", "teachers", "id, name, username"),
+    ("students.db", "students", "id, name, username, semester, department"),
+    ("subjects.db", "subjects", "id, name, teacher_username"),
+    ("teacher_passwords.db", "teacher_passwords", "username, password_hash"),
+    ("student_passwords.db", "student_passwords", "username, password_hash"),
+]
+
+# Teacher subjects that older versions hard-coded in database.py and face/face.py instead of
+# reading the subjects table; they are added for teachers who have no subject assigned
+LEGACY_TEACHER_SUBJECTS = {
+    "teacher01": "DCC",
+    "teacher02": "IEFT",
+    "teacher03": "CD",
+    "teacher04": "AAD",
+    "teacher05": "CGIP",
+    "teacher06": "MP",
+    "teacher07": "NL",
+}
+
+
+# Function to read all rows of a table from a legacy database, or nothing if the file or table is missing
+def read_legacy_rows(path, table, columns):
+    if not os.path.exists(path):
+        return []
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"SELECT {columns} FROM {table}").fetchall()
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+
+# Function to work out which subject a per-subject attendance database belongs to.
+# The subject recorded in ClassesTaken wins; otherwise it comes from the file name, e.g. dcc_attendance.db -> DCC.
+def legacy_subject(path):
+    rows = read_legacy_rows(path, "ClassesTaken", "subject")
+    subjects = {row[0] for row in rows if row[0]}
+    if len(subjects) == 1:
+        return subjects.pop()
+    return os.path.basename(path)[:-len("_attendance.db")].upper()
+
+
+# Function to run INSERT OR IGNORE for each row and return how many rows were inserted and skipped
+def insert_rows(cursor, sql, rows):
+    inserted = 0
+    for row in rows:
+        cursor.execute(sql, row)
+        inserted += cursor.rowcount
+    return inserted, len(rows) - inserted
+
+
+# Function to copy one per-subject attendance database into the attendance tables
+def migrate_attendance(cursor, path, summary):
+    subject = legacy_subject(path)
+    students = {row[0] for row in cursor.execute("SELECT username FROM students")}
+
+    for teacher_name, _, classes_taken in read_legacy_rows(path, "ClassesTaken", "teacher_name, subject, classes_taken"):
+        cursor.execute('''INSERT INTO classes_taken (subject, teacher_username, classes_taken) VALUES (?, ?, ?)
+                          ON CONFLICT (subject, teacher_username) DO UPDATE SET classes_taken = max(classes_taken, excluded.classes_taken)''',
+                       (subject, teacher_name, classes_taken or 0))
+        summary["classes_taken"] += 1
+
+    # Rows for students who are no longer registered would break the foreign keys, so they are skipped
+    for student_id, classes_present, _ in read_legacy_rows(path, "Attendance",
+                                                           "student_id, classes_present, attendance_percentage"):
+        if student_id not in students:
+            summary["orphaned attendance"] += 1
+            continue
+        cursor.execute('''INSERT INTO attendance (subject, student_id, classes_present) VALUES (?, ?, ?)
+                          ON CONFLICT (subject, student_id) DO UPDATE SET classes_present = max(classes_present, excluded.classes_present)''',
+                       (subject, student_id, classes_present or 0))
+        summary["attendance"] += 1
+
+    events = read_legacy_rows(path, "AttendanceEvents", "student_id, subject, date, period, recorded_at")
+    orphaned = [event for event in events if event[0] not in students]
+    inserted, skipped = insert_rows(cursor, '''INSERT OR IGNORE INTO attendance_events
+                                               (student_id, subject, date, period, recorded_at) VALUES (?, ?, ?, ?, ?)''',
+                                    [event for event in events if event[0] in students])
+    summary["attendance events"] += inserted
+    summary["duplicate attendance events"] += skipped
+    summary["orphaned attendance events"] += len(orphaned)
+
+    # Percentages are recomputed rather than copied, since classes taken may have been merged
+    update_attendance_percentages(cursor, subject)
+    return subject
+
+
+# Function to migrate every legacy database in source_dir into the consolidated database.
+# Everything happens in one transaction, so a failed migration leaves the target untouched.
+def migrate(source_dir):
+    init_db()
+    summary = {"classes_taken": 0, "attendance": 0, "attendance events": 0, "duplicate attendance events": 0,
+               "orphaned attendance": 0, "orphaned attendance events": 0}
+    subjects = []
+
+    db = get_db()
+    with db:
+        cursor = db.cursor()
+        for file_name, table, columns in LEGACY_TABLES:
+            rows = read_legacy_rows(os.path.join(source_dir, file_name), table, columns)
+            if table in ("teacher_passwords", "student_passwords"):
+                # Passwords of people who are not registered would break the foreign keys
+                people = "teachers" if table == "teacher_passwords" else "students"
+                registered = {row[0] for row in cursor.execute(f"SELECT username FROM {people}")}
+                summary[f"orphaned {table}"] = sum(1 for row in rows if row[0] not in registered)
+                rows = [row for row in rows if row[0] in registered]
+            elif table == "subjects":
+                # A subject whose teacher is gone keeps its name but loses the teacher
+                registered = {row[0] for row in cursor.execute("SELECT username FROM teachers")}
+                rows = [(id, name, teacher if teacher in registered else None) for id, name, teacher in rows]
+
+            placeholders = ", ".join("?" * len(columns.split(",")))
+            inserted, skipped = insert_rows(cursor, f"INSERT OR IGNORE INTO {table} ({columns}) VALUES ({placeholders})", rows)
+            summary[table] = inserted
+            summary[f"duplicate {table}"] = skipped
+
+        assigned = {row[0] for row in cursor.execute("SELECT teacher_username FROM subjects")}
+        registered = {row[0] for row in cursor.execute("SELECT username FROM teachers")}
+        legacy_subjects = [(subject, teacher) for teacher, subject in LEGACY_TEACHER_SUBJECTS.items()
+                           if teacher in registered and teacher not in assigned]
+        cursor.executemany("INSERT INTO subjects (name, teacher_username) VALUES (?, ?)", legacy_subjects)
+        summary["hard-coded subjects"] = len(legacy_subjects)
+
+        for path in sorted(glob.glob(os.path.join(source_dir, "*_attendance.db"))):
+            subjects.append(migrate_attendance(cursor, path, summary))
+    close_db(db)
+
+    return subjects, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the legacy per-table and per-subject databases into one database")
+    parser.add_argument("--source-dir", default=".", help="directory holding the legacy .db files")
+    parser.add_argument("--target", default=database.DATABASE, help="consolidated database to write")
+    args = parser.parse_args()
+
+    database.DATABASE = args.target
+    subjects, summary = migrate(args.source_dir)
+
+    print("Migrated subjects:", ", ".join(subjects) or "none")
+    for name, count in summary.items():
+        if count:
+            print(f"{name}: {count}")
+
+
+if __name__ == "__main__":
+    main()
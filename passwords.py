@@ -0,0 +1,155 @@
+import os
+import hmac
+import time
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Key derivation used for new hashes: "scrypt" or "pbkdf2_sha256".
+# The cost settings can be raised at any time; older hashes are upgraded at the next login.
+PASSWORD_SCHEME = os.environ.get("PASSWORD_SCHEME", "scrypt")
+SCRYPT_N = int(os.environ.get("PASSWORD_SCRYPT_N", 2 ** 14))  # CPU and memory cost (128 * N * r bytes)
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = int(os.environ.get("PASSWORD_PBKDF2_ITERATIONS", 600000))
+SALT_SIZE = 16
+
+# Key derivations run on a bounded pool, so a login burst queues instead of running every
+# derivation at once; hashlib releases the GIL while deriving, so the workers run in parallel
+VERIFY_WORKERS = int(os.environ.get("PASSWORD_VERIFY_WORKERS", os.cpu_count() or 2))
+
+# Seconds a successful verification is remembered; 0 turns the cache off
+CREDENTIAL_CACHE_TTL = float(os.environ.get("PASSWORD_CACHE_TTL", 300))
+CREDENTIAL_CACHE_SIZE = 4096
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def _derive(scheme, password, salt, params):
+    if scheme == "scrypt":
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 2 ** 20)
+    if scheme == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, params[0])
+    raise ValueError(f"Unknown password scheme: {scheme}")
+
+
+def _current_params(scheme):
+    return (SCRYPT_N, SCRYPT_R, SCRYPT_P) if scheme == "scrypt" else (PBKDF2_ITERATIONS,)
+
+
+# Function to hash a password with a fresh salt.
+# The result records the scheme, cost and salt: "scrypt$16384$8$1$<salt>$<hash>" or
+# "pbkdf2_sha256$600000$<salt>$<hash>".
+def hash_password(password, scheme=None):
+    scheme = scheme or PASSWORD_SCHEME
+    params = _current_params(scheme)
+    salt = os.urandom(SALT_SIZE)
+    derived = _derive(scheme, password, salt, params)
+    return "$".join([scheme] + [str(param) for param in params] + [_b64(salt), _b64(derived)])
+
+
+# Function to tell the unsalted SHA-256 hex digests of older versions apart from KDF hashes
+def is_legacy_hash(stored_hash):
+    return "$" not in stored_hash and len(stored_hash) == 64
+
+
+# Function to decide whether a stored hash should be replaced after a successful login
+def needs_rehash(stored_hash):
+    if is_legacy_hash(stored_hash):
+        return True
+    scheme, *rest = stored_hash.split("$")
+    try:
+        return scheme != PASSWORD_SCHEME or tuple(int(param) for param in rest[:-2]) != _current_params(scheme)
+    except ValueError:
+        return True
+
+
+def _check(password, stored_hash):
+    if is_legacy_hash(stored_hash):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored_hash)
+    try:
+        scheme, *rest = stored_hash.split("$")
+        params = tuple(int(param) for param in rest[:-2])
+        salt, expected = base64.b64decode(rest[-2]), base64.b64decode(rest[-1])
+        return hmac.compare_digest(_derive(scheme, password, salt, params), expected)
+    except (ValueError, IndexError):
+        return False
+
+
+# Remembers recent successful verifications so repeated logins skip the key derivation.
+# Entries are keyed by the stored hash, so a password change invalidates them, and hold an HMAC
+# of the password under a key that only lives in this process, never the password itself.
+class CredentialCache:
+    def __init__(self, ttl=CREDENTIAL_CACHE_TTL, size=CREDENTIAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()  # stored hash -> (password HMAC, expiry)
+        self._lock = threading.Lock()
+
+    def _mac(self, password):
+        return hmac.new(self._key, password.encode(), hashlib.sha256).digest()
+
+    def check(self, password, stored_hash):
+        if self.ttl <= 0:
+            return False
+        with self._lock:
+            entry = self._entries.get(stored_hash)
+            if entry is None:
+                return False
+            if entry[1] < time.monotonic():
+                del self._entries[stored_hash]
+                return False
+            self._entries.move_to_end(stored_hash)
+        return hmac.compare_digest(entry[0], self._mac(password))
+
+    def add(self, password, stored_hash):
+        if self.ttl <= 0:
+            return
+        entry = (self._mac(password), time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[stored_hash] = entry
+            self._entries.move_to_end(stored_hash)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+credential_cache = CredentialCache()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(VERIFY_WORKERS, thread_name_prefix="password-verify")
+        return _executor
+
+
+# Function to check a password against a stored hash of any supported kind
+def verify_password(password, stored_hash):
+    if not stored_hash:
+        return False
+    if credential_cache.check(password, stored_hash):
+        return True
+    verified = _get_executor().submit(_check, password, stored_hash).result()
+    if verified:
+        credential_cache.add(password, stored_hash)
+    return verified
+
+
+# Function to hash a password again after a login that found an outdated hash (see needs_rehash).
+# The hashing runs on the verification pool, so a burst of logins with old hashes is held to
+# the same number of cores as verification.
+def rehash_password(password):
+    return _get_executor().submit(hash_password, password).result()
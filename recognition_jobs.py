@@ -0,0 +1,286 @@
+import os
+import sys
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from timetable import load_timetable, MINUTES_PER_DAY
+
+# The recognizer lives in face/ and imports its modules by their plain names
+FACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "face")
+if FACE_DIR not in sys.path:
+    sys.path.append(FACE_DIR)
+
+# Jobs running at once; further jobs wait in the queue
+JOB_WORKERS = 2
+# Processes shared by all jobs for face detection and for face encoding
+RECOGNITION_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+# Camera and timetable room used for live sessions started from the web app; a room without
+# timetable rows, or None, follows the default period schedule
+CAMERA_SOURCE = os.environ.get("RECOGNITION_CAMERA", "0")
+CAMERA_ROOM = os.environ.get("RECOGNITION_ROOM") or None
+# Longest a live session runs when the timetable gives it no end
+SESSION_MAX_DURATION = timedelta(hours=2)
+# Uploaded clips are sampled every UPLOAD_FRAME_STEP frames, up to UPLOAD_MAX_FRAMES frames
+UPLOAD_FRAME_STEP = 5
+UPLOAD_MAX_FRAMES = 300
+UPLOAD_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.mp4', '.avi', '.mov', '.mkv', '.webm')
+# Finished jobs kept for their status and results
+FINISHED_JOBS_KEPT = 100
+
+FINISHED_STATES = ("finished", "stopped", "failed")
+
+
+# Frames of an uploaded photo or clip, read like a camera; finished is set once all are read
+class UploadCapture:
+    def __init__(self, path, step=UPLOAD_FRAME_STEP, max_frames=UPLOAD_MAX_FRAMES):
+        import cv2
+        self.step = step
+        self.max_frames = max_frames
+        self.frames_read = 0
+        self.finished = False
+        self._image = cv2.imread(path)
+        self._capture = None if self._image is not None else cv2.VideoCapture(path)
+
+    def read(self):
+        if not self.finished and self._image is not None:
+            self.finished = True
+            self.frames_read = 1
+            return True, self._image
+        if not self.finished and self.frames_read < self.max_frames:
+            for _ in range(self.step - 1):
+                self._capture.grab()
+            ret, frame = self._capture.read()
+            if ret:
+                self.frames_read += 1
+                return True, frame
+        # The pipeline stops capturing once it sees finished
+        self.finished = True
+        return False, None
+
+    def release(self):
+        if self._capture is not None:
+            self._capture.release()
+
+
+# One recognition job: a live camera session or an uploaded photo or clip, for one subject.
+# Progress is published as numbered snapshots, so any number of clients can wait for the next one.
+class RecognitionJob:
+    def __init__(self, kind, teacher_username, subject, period, path=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.teacher_username = teacher_username
+        self.subject = subject
+        self.period = period
+        self.path = path
+        self.created_at = datetime.now().isoformat(timespec="seconds")
+
+        self.state = "queued"
+        self.error = None
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.faces_detected = 0
+        self.recognized = []
+        self.marked = []
+        self.version = 0
+        self.stopped = threading.Event()
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def update(self, **changes):
+        with self._changed:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+
+    def snapshot(self):
+        return {
+            "id": self.id, "kind": self.kind, "state": self.state, "error": self.error,
+            "subject": self.subject, "period": self.period, "created_at": self.created_at,
+            "frames_captured": self.frames_captured, "frames_processed": self.frames_processed,
+            "faces_detected": self.faces_detected, "recognized": self.recognized, "marked": self.marked,
+            "version": self.version,
+        }
+
+    # Function to wait until the job has changed since the given version, or the timeout passes
+    def wait(self, version, timeout=None):
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.snapshot()
+
+
+# Background recognition for the web app.
+# Requests only create a job and queue it, so they return at once; jobs run on a small thread
+# pool, and their face detection and encoding go to process pools shared by every job.
+# The gallery, the pools and the attendance writer are set up by the first job, so the web app
+# starts without loading the recognizer.
+class JobManager:
+    def __init__(self, workers=JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="recognition-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._recognizer = None
+        self._recognizer_lock = threading.Lock()
+
+    # Function to find the scheduled period now, from the timetable or the default period schedule
+    def current_period(self, room=CAMERA_ROOM):
+        from face import PERIOD_SCHEDULE
+        class_session = load_timetable(PERIOD_SCHEDULE).session_at(room, datetime.now())
+        return class_session.period if class_session else None
+
+    # Function to start recognizing the classroom camera until the period ends or the job is stopped.
+    # A teacher has at most one live session at a time.
+    def start_session(self, teacher_username, subject, period):
+        with self._lock:
+            for job in self._jobs.values():
+                if job.kind == "session" and job.teacher_username == teacher_username and not job.finished:
+                    raise ValueError("A recognition session is already running")
+            return self._submit(RecognitionJob("session", teacher_username, subject, period))
+
+    # Function to recognize the students in an uploaded photo or clip; the file is deleted afterwards
+    def start_upload(self, teacher_username, subject, period, path):
+        with self._lock:
+            return self._submit(RecognitionJob("upload", teacher_username, subject, period, path))
+
+    def _submit(self, job):
+        self._jobs[job.id] = job
+        finished = [job_id for job_id, old in self._jobs.items() if old.finished]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self._jobs[job_id]
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs_for(self, teacher_username):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.teacher_username == teacher_username]
+
+    def stop(self, job):
+        job.stopped.set()
+        if job.state == "queued":
+            job.update(state="stopped")
+
+    def _load_recognizer(self):
+        with self._recognizer_lock:
+            if self._recognizer is None:
+                from face import KNOWN_FACES_DIR_STUDENTS, KNOWN_FACES_DIR_TEACHERS, MATCH_MIN_MARGIN
+                from gallery import Gallery
+                from pipeline import FairExecutor
+                from attdatabase import AttendanceWriter
+
+                gallery = Gallery(KNOWN_FACES_DIR_STUDENTS, KNOWN_FACES_DIR_TEACHERS, min_margin=MATCH_MIN_MARGIN,
+                                  workers=1)
+                gallery.start()
+                self._recognizer = {
+                    "gallery": gallery,
+                    "detect_executor": FairExecutor(RECOGNITION_WORKERS),
+                    "encode_executor": FairExecutor(RECOGNITION_WORKERS),
+                    "writer": AttendanceWriter(flush_interval=1.0),
+                }
+            return self._recognizer
+
+    def _run(self, job):
+        try:
+            # Jobs stopped while still queued never start
+            if job.stopped.is_set():
+                return
+            job.update(state="running")
+            recognizer = self._load_recognizer()
+            if job.kind == "session":
+                self._run_session(job, recognizer)
+            else:
+                self._run_upload(job, recognizer)
+            job.update(state="stopped" if job.stopped.is_set() else "finished")
+        except Exception as e:
+            print("Error in recognition job:", e)
+            job.update(state="failed", error=str(e))
+        finally:
+            if job.path:
+                try:
+                    os.remove(job.path)
+                except OSError:
+                    pass
+
+    def _run_session(self, job, recognizer):
+        from face import PERIOD_SCHEDULE
+        from service import ReconnectingCapture
+        from detection import DetectionConfig
+
+        end = self._session_end(load_timetable(PERIOD_SCHEDULE), job.period, datetime.now())
+        capture = ReconnectingCapture(CAMERA_SOURCE)
+        self._recognize(job, recognizer, capture, DetectionConfig(), 4, lambda pipeline: datetime.now() >= end)
+
+    # Function to work out when a live session stops by itself: at the end of its period today, or
+    # of the period running now, and never more than SESSION_MAX_DURATION after it starts
+    def _session_end(self, timetable, period, now):
+        latest = now + SESSION_MAX_DURATION
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for class_session in timetable.sessions_on(CAMERA_ROOM, now.weekday()):
+            end = today + timedelta(minutes=class_session.end - class_session.weekday * MINUTES_PER_DAY)
+            if class_session.period == period and end > now:
+                return min(end, latest)
+        if timetable.session_at(CAMERA_ROOM, now) is not None:
+            return min(timetable.next_transition(CAMERA_ROOM, now), latest)
+        return latest
+
+    def _run_upload(self, job, recognizer):
+        from detection import DetectionConfig
+
+        capture = UploadCapture(job.path)
+        # Every sampled frame is looked at, however little changed since the last one, and none is dropped
+        detection_config = DetectionConfig(motion_threshold=0)
+        self._recognize(job, recognizer, capture, detection_config, UPLOAD_MAX_FRAMES,
+                        lambda pipeline: capture.finished and pipeline.frames_processed + pipeline.frames_skipped
+                        + pipeline.frames_failed + pipeline.dropped_frames >= pipeline.frames_captured)
+
+    # Function to run a capture through a recognition pipeline into an attendance session until done() says so
+    def _recognize(self, job, recognizer, capture, detection_config, queue_size, done):
+        from pipeline import FramePipeline
+        from tracker import FaceTracker
+        from session import AttendanceSession
+        from presence import presence_cache
+        from attdatabase import get_teacher_subject_map
+
+        gallery = recognizer["gallery"]
+        session = AttendanceSession(gallery.teacher_names, gallery.student_names, get_teacher_subject_map(),
+                                    job.period, writer=recognizer["writer"], expected_subject=job.subject,
+                                    presence=presence_cache)
+        # The teacher started the job from their login, so the class starts without seeing them
+        session.start_class(job.teacher_username)
+        recognized = set()
+
+        def on_recognized(recognized_faces):
+            session.handle(recognized_faces)
+            recognized.update(recognized_faces)
+            job.update(recognized=sorted(recognized), marked=sorted(session.recorded_students))
+
+        def on_stats(stats):
+            job.update(frames_captured=pipeline.frames_captured, frames_processed=pipeline.frames_processed,
+                       faces_detected=pipeline.faces_detected)
+
+        pipeline = FramePipeline(capture, gallery.matcher, on_recognized, detect_workers=RECOGNITION_WORKERS,
+                                 encode_workers=RECOGNITION_WORKERS, queue_size=queue_size,
+                                 detection_config=detection_config, tracker=FaceTracker(), on_stats=on_stats,
+                                 detect_executor=recognizer["detect_executor"],
+                                 encode_executor=recognizer["encode_executor"], name=f"job-{job.id[:8]}")
+        pipeline.start()
+        try:
+            while not job.stopped.wait(0.2) and not done(pipeline):
+                pass
+        finally:
+            pipeline.stop()
+            capture.release()
+            recognizer["writer"].flush()
+            job.update(frames_captured=pipeline.frames_captured, frames_processed=pipeline.frames_processed,
+                       faces_detected=pipeline.faces_detected)
+
+
+job_manager = JobManager()
@@ -0,0 +1,211 @@
+import csv
+import argparse
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+import database
+from database import get_db, close_db, init_db, get_cache_version
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# One scheduled class. start and end are minutes into the week (Monday 00:00 is 0), end exclusive.
+# room is None for schedules that apply to every room.
+ClassSession = namedtuple("ClassSession", "room weekday period start end subject teacher_username")
+
+
+def _minutes(hh_mm):
+    hours, minutes = hh_mm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _minute_of_week(when):
+    return when.weekday() * MINUTES_PER_DAY + when.hour * 60 + when.minute
+
+
+# Function to make a session from "HH:MM" times; like the old schedule, the end minute is included
+def make_session(room, weekday, period, start_time, end_time, subject=None, teacher_username=None):
+    day = weekday * MINUTES_PER_DAY
+    start, end = day + _minutes(start_time), day + _minutes(end_time) + 1
+    if end <= start:
+        raise ValueError(f"Period {period} on {WEEKDAYS[weekday]} in {room} ends before it starts")
+    return ClassSession(room, weekday, period, start, end, subject, teacher_username)
+
+
+# Function to make the sessions of the old period schedule, for every room (room None) on each weekday
+def period_sessions(period_schedule, weekdays=range(7)):
+    return [make_session(None, weekday, i + 1, period["start_time"], period["end_time"])
+            for weekday in weekdays for i, period in enumerate(period_schedule)]
+
+
+# Weekly timetable with holidays, indexed for lookups by time.
+# Each room's sessions are kept sorted by start, so "what is on now" and "what starts next" are
+# binary searches. Rooms without sessions of their own use the
+# sessions with room None.
+class Timetable:
+    def __init__(self, sessions, holidays=()):
+        self.holidays = {day if isinstance(day, str) else day.isoformat() for day in holidays}
+        self._sessions = {}
+        for session in sorted(sessions, key=lambda session: session.start):
+            room_sessions = self._sessions.setdefault(session.room, [])
+            if room_sessions and room_sessions[-1].end > session.start:
+                raise ValueError(f"Period {session.period} on {WEEKDAYS[session.weekday]} overlaps "
+                                 f"period {room_sessions[-1].period} in {session.room or 'every room'}")
+            room_sessions.append(session)
+
+        self._starts = {room: [session.start for session in room_sessions]
+                        for room, room_sessions in self._sessions.items()}
+
+    # Function to build the same timetable for every room and weekday from the old period schedule
+    @classmethod
+    def from_periods(cls, period_schedule, holidays=(), weekdays=range(7)):
+        return cls(period_sessions(period_schedule, weekdays), holidays)
+
+    def _room_key(self, room):
+        return room if room in self._sessions else None
+
+    @property
+    def rooms(self):
+        return [room for room in self._sessions if room is not None]
+
+    def is_holiday(self, when):
+        return when.date().isoformat() in self.holidays
+
+    # Function to find the session running in a room at a given time, or None
+    def session_at(self, room, when):
+        key = self._room_key(room)
+        if key not in self._sessions or self.is_holiday(when):
+            return None
+        minute = _minute_of_week(when)
+        i = bisect_right(self._starts[key], minute) - 1
+        if i >= 0 and minute < self._sessions[key][i].end:
+            return self._sessions[key][i]
+        return None
+
+    # Function to find when the next session starts or ends in a room after a given time.
+    # While a session runs that is its end, even when a holiday follows; otherwise it is the next
+    # start that is not on a holiday. None means nothing is ever scheduled.
+    def next_transition(self, room, when):
+        key = self._room_key(room)
+        starts = self._starts.get(key)
+        if not starts:
+            return None
+
+        week_start = (when - timedelta(days=when.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+        current = self.session_at(room, when)
+        if current is not None:
+            return week_start + timedelta(minutes=current.end)
+
+        i = bisect_right(starts, _minute_of_week(when))
+        # Look up to a year ahead, in case of long holidays
+        for _ in range(len(starts) * 53):
+            if i == len(starts):
+                i = 0
+                week_start += timedelta(days=7)
+            start = week_start + timedelta(minutes=starts[i])
+            if not self.is_holiday(start):
+                return start
+            i += 1
+        return None
+
+    # Function to list a room's sessions on a weekday, in order
+    def sessions_on(self, room, weekday):
+        return [session for session in self._sessions.get(self._room_key(room), []) if session.weekday == weekday]
+
+
+# Timetable per database file and default schedule, with the version it was built from
+_timetables = {}
+_timetables_lock = threading.Lock()
+
+
+# Function to load the timetable and holidays from the database.
+# The result is cached until the timetable or holidays tables change. Rooms without timetable rows,
+# including room None, follow default_periods (the old global period schedule) on every day.
+def load_timetable(default_periods=None):
+    db = get_db()
+    cursor = db.cursor()
+    version = get_cache_version(cursor, "timetable")
+    key = (database.DATABASE, tuple((period["start_time"], period["end_time"]) for period in default_periods or ()))
+    with _timetables_lock:
+        cached = _timetables.get(key)
+    if cached is not None and cached[0] == version:
+        close_db(db)
+        return cached[1]
+
+    cursor.execute('''SELECT room, weekday, period, start_time, end_time, subject, teacher_username
+                      FROM timetable ORDER BY room, weekday, start_time''')
+    rows = cursor.fetchall()
+    cursor.execute("SELECT date FROM holidays")
+    holidays = [row[0] for row in cursor.fetchall()]
+    close_db(db)
+
+    sessions = [make_session(*row) for row in rows]
+    if default_periods:
+        # Sessions for room None, used by every room without rows of its own
+        sessions += period_sessions(default_periods)
+    timetable = Timetable(sessions, holidays)
+
+    with _timetables_lock:
+        _timetables[key] = (version, timetable)
+    return timetable
+
+
+def _weekday(value):
+    value = value.strip().lower()
+    return int(value) if value.isdigit() else WEEKDAYS.index(value[:3])
+
+
+# Function to replace the timetable with the rows of a CSV file with
+# "room,weekday,period,start_time,end_time,subject,teacher_username" columns; weekday is 0-6 or Mon-Sun.
+# The file is checked for overlaps before anything is written.
+def import_timetable(csv_file):
+    rows = [(row["room"], _weekday(row["weekday"]), int(row["period"]), row["start_time"], row["end_time"],
+             row.get("subject") or None, row.get("teacher_username") or None)
+            for row in csv.DictReader(csv_file)]
+    Timetable([make_session(*row) for row in rows])
+
+    db = get_db()
+    with db:
+        db.execute("DELETE FROM timetable")
+        db.executemany('''INSERT INTO timetable (room, weekday, period, start_time, end_time, subject, teacher_username)
+                          VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+    close_db(db)
+    return len(rows)
+
+
+def add_holiday(day, name=None):
+    db = get_db()
+    with db:
+        db.execute("INSERT OR REPLACE INTO holidays (date, name) VALUES (?, ?)", (date.fromisoformat(day).isoformat(), name))
+    close_db(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the class timetable and holidays")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="replace the timetable with a CSV file")
+    import_parser.add_argument("csv")
+    holiday_parser = commands.add_parser("holiday", help="add a holiday")
+    holiday_parser.add_argument("date", help="YYYY-MM-DD")
+    holiday_parser.add_argument("name", nargs="?")
+    show_parser = commands.add_parser("show", help="show what is on in a room now and next")
+    show_parser.add_argument("room")
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "import":
+        with open(args.csv, newline='') as csv_file:
+            print(f"Imported {import_timetable(csv_file)} periods")
+    elif args.command == "holiday":
+        add_holiday(args.date, args.name)
+    else:
+        timetable = load_timetable()
+        now = datetime.now()
+        print("Now:", timetable.session_at(args.room, now))
+        print("Next change:", timetable.next_transition(args.room, now))
+
+
+if __name__ == "__main__":
+    main()